@@ -0,0 +1,71 @@
+import numpy as np
+import spatial
+
+# Recommended target half width of the confidence intervals in km
+DEFAULT_PRECISION = 0.01
+
+# Number of suggestions drawn per block
+BLOCK_SIZE = 256
+
+# Stop after this many suggestions even if the target precision was not reached
+MAX_RUNS = 100000
+
+# Two sided normal quantiles for the supported confidence levels
+Z_VALUES = {0.90: 1.6449, 0.95: 1.9600, 0.99: 2.5758}
+
+# Draw suggestions in blocks until the privacy and utility estimates are precise enough
+# candidates is a list of (lat, lon) and each draw picks one uniformly at random unless
+# draw is given, draw(size, rng) returns the positions of size suggested candidates.
+# Privacy is the distance from the user to the centroid of the suggestions and utility
+# is the average walking distance to them, both in km. The centroid is a mean of
+# (x, y) offsets so its confidence interval follows from their standard errors, and
+# since the distance to the centroid changes by at most as much as the centroid
+# moves that interval also bounds the privacy estimate.
+# Returns the estimates, their half widths, the number of runs and the per candidate counts.
+def estimate(user_lat, user_lon, candidates, precision, confidence=0.95,
+             block_size=BLOCK_SIZE, max_runs=MAX_RUNS, rng=None, draw=None):
+    if rng is None:
+        rng = np.random.default_rng()
+    if draw is None:
+        draw = lambda size, rng: rng.integers(len(candidates), size=size)
+    z = Z_VALUES[confidence]
+    candidates = np.asarray(candidates, dtype=float).reshape(-1, 2)
+    x, y = spatial.project(candidates[:, 0], candidates[:, 1], user_lat, user_lon)
+    walk = np.hypot(x, y)
+
+    # Per candidate counts are enough for the means and variances, so memory does not grow with runs
+    counts = np.zeros(len(candidates), dtype=np.int64)
+    runs = 0
+    while True:
+        size = min(block_size, max_runs - runs)
+        counts += np.bincount(draw(size, rng), minlength=len(candidates))
+        runs += size
+
+        result = summarize(counts, x, y, walk, z)
+        if runs >= max_runs or (runs > 1 and max(result['privacy_ci'], result['utility_ci']) <= precision):
+            break
+
+    result['runs'] = runs
+    result['counts'] = counts
+    return result
+
+# Estimates and confidence half widths from per candidate counts
+def summarize(counts, x, y, walk, z):
+    runs = counts.sum()
+    weights = counts / runs
+    mean_x = weights @ x
+    mean_y = weights @ y
+    mean_walk = weights @ walk
+
+    # Sample variances with Bessel's correction
+    scale = runs / max(runs - 1, 1)
+    var_x = scale * (weights @ (x - mean_x) ** 2)
+    var_y = scale * (weights @ (y - mean_y) ** 2)
+    var_walk = scale * (weights @ (walk - mean_walk) ** 2)
+
+    return {
+        'privacy': float(np.hypot(mean_x, mean_y)),
+        'utility': float(mean_walk),
+        'privacy_ci': float(z * np.sqrt((var_x + var_y) / runs)),
+        'utility_ci': float(z * np.sqrt(var_walk / runs)),
+    }
@@ -0,0 +1,126 @@
+import numpy as np
+
+# Radius of the earth in km, same value the haversine functions use
+EARTH_RADIUS = 6371.0
+
+# Number of grid cells along each side of the adversary's search area
+GRID_SIZE = 41
+
+# Vectorized haversine distance, every argument can be a numpy array
+def haversine(lat1, lon1, lat2, lon2):
+    lat1_rad = np.radians(lat1)
+    lon1_rad = np.radians(lon1)
+    lat2_rad = np.radians(lat2)
+    lon2_rad = np.radians(lon2)
+
+    dlon = lon2_rad - lon1_rad
+    dlat = lat2_rad - lat1_rad
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS * c
+
+# Build a square grid of possible true locations centered on the user
+# The grid has an odd number of cells so the center cell is the user's exact location
+def build_grid(user_lat, user_lon, extent, grid_size=GRID_SIZE):
+    if grid_size % 2 == 0:
+        grid_size += 1
+    dlat = np.degrees(extent / EARTH_RADIUS)
+    dlon = dlat / np.cos(np.radians(user_lat))
+    lats = np.linspace(user_lat - dlat, user_lat + dlat, grid_size)
+    lons = np.linspace(user_lon - dlon, user_lon + dlon, grid_size)
+    grid_lat, grid_lon = np.meshgrid(lats, lons, indexing='ij')
+    return grid_lat.ravel(), grid_lon.ravel()
+
+# Radius around the user that holds every candidate any grid cell can reach
+# Callers fetch the candidates of the whole area with it and pass them to build_model
+def area_radius(rad, extent=None):
+    return (rad if extent is None else extent) + rad
+
+# Precompute everything about the adversary that does not depend on the suggestions
+# The adversary knows the mechanism: a suggestion is drawn uniformly from the candidates
+# within rad km of the true location. The prior is uniform over the grid cells within
+# extent km of the user (extent defaults to rad).
+# candidates are the ones the suggestions are counted against. area is every candidate
+# within area_radius of the user, so cells away from the user count all the candidates
+# they could draw from and not only the ones near the user (defaults to candidates).
+# Cells with no candidate in range could not have made any suggestion and are left out.
+def build_model(user_lat, user_lon, rad, candidates, extent=None, grid_size=GRID_SIZE, area=None):
+    if extent is None:
+        extent = rad
+    candidates = np.asarray(candidates, dtype=float).reshape(-1, 2)
+    area = candidates if area is None else np.asarray(area, dtype=float).reshape(-1, 2)
+    grid_lat, grid_lon = build_grid(user_lat, user_lon, extent, grid_size)
+
+    # Keep the cells inside the circle so the prior matches the search area
+    to_user = haversine(user_lat, user_lon, grid_lat, grid_lon)
+    inside = to_user <= extent
+    grid_lat = grid_lat[inside]
+    grid_lon = grid_lon[inside]
+    to_user = to_user[inside]
+
+    # reachable[i] is the number of candidates grid cell i draws from
+    reachable = (haversine(grid_lat[:, None], grid_lon[:, None], area[None, :, 0], area[None, :, 1]) <= rad).sum(axis=1)
+    possible = reachable > 0
+    grid_lat = grid_lat[possible]
+    grid_lon = grid_lon[possible]
+    to_user = to_user[possible]
+    reachable = reachable[possible]
+
+    # in_range[i, j] is True when candidate j could be suggested from grid cell i
+    dist = haversine(grid_lat[:, None], grid_lon[:, None], candidates[None, :, 0], candidates[None, :, 1])
+    in_range = dist <= rad
+
+    with np.errstate(divide='ignore'):
+        log_in_range = np.log(in_range.astype(float))
+    log_reachable = np.log(reachable.astype(float))
+
+    return {
+        'grid_lat': grid_lat,
+        'grid_lon': grid_lon,
+        'to_user': to_user,
+        'log_in_range': log_in_range,
+        'log_reachable': log_reachable,
+    }
+
+# Posterior over the grid cells given how many times each candidate was suggested
+def posterior(model, counts):
+    counts = np.asarray(counts, dtype=float)
+    log_in_range = model['log_in_range']
+
+    # Only the suggested candidates contribute, this also avoids 0 * -inf for the rest
+    used = counts > 0
+    log_like = log_in_range[:, used] @ counts[used] - counts.sum() * model['log_reachable']
+    log_like = np.where(np.isfinite(log_like), log_like, -np.inf)
+
+    # No cell can explain the suggestions, fall back to the prior
+    if not np.isfinite(log_like).any():
+        return np.full(len(log_like), 1.0 / len(log_like))
+
+    weights = np.exp(log_like - log_like.max())
+    return weights / weights.sum()
+
+# Expected distance between the adversary's guess and the user's true location
+# The guess is drawn from the posterior, so this is the expected estimation error
+# of a Bayesian adversary. Higher is more private.
+def expected_error(model, counts):
+    # With no suggestions the adversary can only guess from the prior
+    if np.sum(counts) == 0:
+        return float(model['to_user'].mean())
+    post = posterior(model, counts)
+    return float(post @ model['to_user'])
+
+# One call version of the metric for a single set of suggestions
+# candidates and suggestions are sequences of (lat, lon)
+def adversary_error(user_lat, user_lon, rad, candidates, suggestions, extent=None, grid_size=GRID_SIZE, area=None):
+    candidates = np.asarray(candidates, dtype=float).reshape(-1, 2)
+    suggestions = np.asarray(suggestions, dtype=float).reshape(-1, 2)
+    if len(candidates) == 0 or len(suggestions) == 0:
+        return 0.0
+
+    # Map every suggestion back to the candidate it came from
+    dist = haversine(suggestions[:, None, 0], suggestions[:, None, 1], candidates[None, :, 0], candidates[None, :, 1])
+    counts = np.bincount(dist.argmin(axis=1), minlength=len(candidates))
+
+    model = build_model(user_lat, user_lon, rad, candidates, extent, grid_size, area)
+    return expected_error(model, counts)
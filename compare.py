@@ -1,11 +1,30 @@
+import os
 import subprocess
 import time
 import math
 import re
 from geopy.geocoders import Nominatim
 from geopy.distance import geodesic
-import statistics
 import matplotlib.pyplot as plt
+import store
+import osm_cache
+import adversary
+
+# Noise in degrees that poi.py adds to the chosen POIs
+POI_NOISE = 0.002
+
+# Target precision in km passed to the methods when the number of runs is 'auto'
+ADAPTIVE_PRECISION = 0.01
+
+# Seed passed to the random methods, so a stored result is exactly what running again gives
+SEED = 0
+
+# Color and marker of each method in the tradeoff plot
+PLOT_STYLES = {
+    "POI": ('blue', 'o'),
+    "Walkable": ('green', '^'),
+    "GeoInd": ('purple', 's'),
+}
 
 # Generate coordinates from an address
 def get_coordinates(address):
@@ -26,6 +45,24 @@ def extract_coords_from_file(filepath):
                 coords.append((lat, lon))
     return coords
 
+# Get the adversary error that poi.py and walkable.py write at the end of their files
+def extract_adversary_error(filepath):
+    with open(filepath, 'r', encoding='utf-8') as file:
+        for line in file:
+            match = re.match(r"Adversary error: ([-\d.e]+)", line)
+            if match:
+                return float(match.group(1))
+    return None
+
+# Get the number of runs an adaptive run used, or None for a fixed number of runs
+def extract_runs_used(filepath):
+    with open(filepath, 'r', encoding='utf-8') as file:
+        for line in file:
+            match = re.match(r"Runs used: (\d+)", line)
+            if match:
+                return int(match.group(1))
+    return None
+
 # Find the average distance between two coordinates
 def average_distance(from_coord, to_coords):
     if not to_coords:
@@ -42,9 +79,45 @@ def centroid(coords):
     return (lat, lon)
 
 
+# Epsilon for geoind.py, picked so the average perturbation is half the radius
+def geoind_epsilon(radius):
+    return 4 / radius
+
+# Store keys of every method for one location
+def method_keys(address, radius, num_runs):
+    return {
+        "POI": store.make_key(address, radius, "POI", POI_NOISE, num_runs, SEED),
+        "Walkable": store.make_key(address, radius, "Walkable", None, num_runs),
+        "GeoInd": store.make_key(address, radius, "GeoInd", geoind_epsilon(radius), num_runs, SEED),
+    }
+
 # def run_program(command):
 #     subprocess.run(command, shell=True)
 
+# Run one method script with its input and wait for its output file
+# The output file of the previous run is removed first, so a run that fails never leaves
+# another location's result behind to be read. Returns True when the script exited
+# cleanly and wrote its output file.
+def run_method(script, method_input, output, show_popups):
+    if os.path.exists(output):
+        os.remove(output)
+    proc = subprocess.Popen(
+        f'python {script}',
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        shell=show_popups
+    )
+    _, errors = proc.communicate(input=method_input)
+    time.sleep(2)
+    if proc.returncode != 0 or not os.path.exists(output):
+        print(f"{script} failed (exit code {proc.returncode}), its result is not stored")
+        if errors:
+            print(errors.strip().splitlines()[-1])
+        return False
+    return True
+
 def main():
     # Use the text file as input
     with open("day_in_a_life.txt", "r", encoding="utf-8") as file:
@@ -54,10 +127,20 @@ def main():
     if (lines[0] == 'y' or lines[0] == 'Y'):
         show_popups = True
 
+    # Results already computed are read back from the store instead of rerun
+    conn = store.open_store()
     results = []
+    keys = []
     num_runs = lines[1]
+
+    # With 'auto' the random methods also need the target precision
+    runs_input = num_runs
+    if num_runs.lower() == 'auto':
+        runs_input = f"auto\n{ADAPTIVE_PRECISION}"
+
+    # Parse the text file for the required input
+    locations = []
     for i in range(2, len(lines), 2):
-        # Parse the text file for the required input
         address = lines[i]
         radius = float(lines[i + 1])
         coords = get_coordinates(address)
@@ -65,81 +148,115 @@ def main():
         if not coords[0]:
             print(f"Skipping invalid address: {address}")
             continue
+        locations.append((address, radius, coords))
 
+    # Fill the candidate cache for every location that still has to run before any method runs
+    # Nearby addresses share tiles so this takes a few bbox queries instead of one per address.
+    # The methods also read the wider area the adversary model needs, so that is fetched too.
+    circles = [
+        (coords[0], coords[1], adversary.area_radius(radius)) for address, radius, coords in locations
+        if any(store.lookup(conn, key) is None for key in method_keys(address, radius, num_runs).values())
+    ]
+    if circles:
+        osm_cache.prefetch_circles(circles)
+
+    for address, radius, coords in locations:
         print(f"\nProcessing location: {address} (radius {radius} km)")
+        keys_for_location = method_keys(address, radius, num_runs)
 
         # Run the poi.py method using the input from text file
-        print("Running POI-based method...")
-        proc = subprocess.Popen(
-            f'python poi.py',
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            shell=show_popups
-        )
-        proc.communicate(input=f"address\n{address}\n{radius}\n0.002\n{num_runs}\n")
-        time.sleep(2)
-
-        # Determine the privacy and utility for a single location for POI method
-        poi_coords = extract_coords_from_file("POIs.txt")
-        utility_poi = average_distance(coords, poi_coords)
-        centroid_poi = centroid(poi_coords)
-        privacy_poi = geodesic(coords, centroid_poi).km if centroid_poi[0] is not None else float('inf')
-        results.append((address, "POI", utility_poi, privacy_poi)) 
+        key = keys_for_location["POI"]
+        row = store.lookup(conn, key)
+        if row is None:
+            print("Running POI-based method...")
+            poi_input = f"address\n{address}\n{radius}\n{POI_NOISE}\n\n{runs_input}\n{SEED}\n"
+            if run_method("poi.py", poi_input, "POIs.txt", show_popups):
+                # Determine the privacy and utility for a single location for POI method
+                poi_coords = extract_coords_from_file("POIs.txt")
+                utility_poi = average_distance(coords, poi_coords)
+                centroid_poi = centroid(poi_coords)
+                privacy_poi = geodesic(coords, centroid_poi).km if centroid_poi[0] is not None else float('inf')
+                adversary_poi = extract_adversary_error("POIs.txt")
+                runs_poi = extract_runs_used("POIs.txt")
+                store.append(conn, key, coords, utility_poi, privacy_poi, adversary_poi, runs_poi)
+                row = (utility_poi, privacy_poi, adversary_poi, runs_poi)
+        else:
+            print("Using stored POI-based result...")
+        if row is not None:
+            utility_poi, privacy_poi, adversary_poi, runs_poi = row
+            keys.append(key)
+            results.append((address, "POI", utility_poi, privacy_poi, adversary_poi, runs_poi))
 
         # Run the walkable.py method using input from text file
-        print("Running Walkable method...")
-        proc = subprocess.Popen(
-            f'python walkable.py',
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            shell=show_popups
-        )
-        proc.communicate(input=f"address\n{address}\n{radius}\n{num_runs}\n")
-        time.sleep(2)
-
-        # Determine the privacy and utility for a single location for walkable method
-        walkable_coords = extract_coords_from_file("Walkable.txt")
-        utility_osrm = average_distance(coords, walkable_coords)
-        centroid_osrm = centroid(walkable_coords)
-        privacy_osrm = geodesic(coords, centroid_osrm).km if centroid_osrm[0] is not None else float('inf')
-        results.append((address, "Walkable", utility_osrm, privacy_osrm)) 
-
-    # Print summary
-    total_utility_poi = []
-    total_privacy_poi = []
-    total_utility_osrm = []
-    total_privacy_osrm = []
+        key = keys_for_location["Walkable"]
+        row = store.lookup(conn, key)
+        if row is None:
+            print("Running Walkable method...")
+            walkable_input = f"address\n{address}\n{radius}\n{num_runs}\n"
+            if run_method("walkable.py", walkable_input, "Walkable.txt", show_popups):
+                # Determine the privacy and utility for a single location for walkable method
+                walkable_coords = extract_coords_from_file("Walkable.txt")
+                utility_osrm = average_distance(coords, walkable_coords)
+                centroid_osrm = centroid(walkable_coords)
+                privacy_osrm = geodesic(coords, centroid_osrm).km if centroid_osrm[0] is not None else float('inf')
+                adversary_osrm = extract_adversary_error("Walkable.txt")
+                store.append(conn, key, coords, utility_osrm, privacy_osrm, adversary_osrm)
+                row = (utility_osrm, privacy_osrm, adversary_osrm, None)
+        else:
+            print("Using stored Walkable result...")
+        if row is not None:
+            utility_osrm, privacy_osrm, adversary_osrm, _ = row
+            keys.append(key)
+            results.append((address, "Walkable", utility_osrm, privacy_osrm, adversary_osrm, None))
+
+        # Run the geoind.py method using input from text file
+        epsilon = geoind_epsilon(radius)
+        key = keys_for_location["GeoInd"]
+        row = store.lookup(conn, key)
+        if row is None:
+            print("Running Geo-Indistinguishability method...")
+            geoind_input = f"address\n{address}\n{radius}\n{epsilon}\n{runs_input}\n{SEED}\n"
+            if run_method("geoind.py", geoind_input, "GeoInd.txt", show_popups):
+                # Determine the privacy and utility for a single location for geo-indistinguishability method
+                geoind_coords = extract_coords_from_file("GeoInd.txt")
+                utility_geoind = average_distance(coords, geoind_coords)
+                centroid_geoind = centroid(geoind_coords)
+                privacy_geoind = geodesic(coords, centroid_geoind).km if centroid_geoind[0] is not None else float('inf')
+                runs_geoind = extract_runs_used("GeoInd.txt")
+                store.append(conn, key, coords, utility_geoind, privacy_geoind, None, runs_geoind)
+                row = (utility_geoind, privacy_geoind, None, runs_geoind)
+        else:
+            print("Using stored Geo-Indistinguishability result...")
+        if row is not None:
+            utility_geoind, privacy_geoind, _, runs_geoind = row
+            keys.append(key)
+            results.append((address, "GeoInd", utility_geoind, privacy_geoind, None, runs_geoind))
 
     # Show privacy/utility tradeoff for each location, for each method
     print("\n==== Privacy vs Utility Summary ====")
-    for address, method, utility, privacy in results:
+    for address, method, utility, privacy, adversary_error, runs_used in results:
         print(f"Address: {address}")
         print(f"  Method: {method}")
         print(f"  Utility: {utility:.4f} km")
         print(f"  Privacy: {privacy: .4f} km")
+        if adversary_error is not None:
+            print(f"  Adversary Error: {adversary_error:.4f} km")
+        if runs_used is not None:
+            print(f"  Runs Used: {runs_used}")
         print()
-        if method == "POI":
-            total_utility_poi.append(utility)
-            total_privacy_poi.append(privacy)
-        if method == "Walkable":
-            total_utility_osrm.append(utility)
-            total_privacy_osrm.append(privacy)
 
     # Show average privacy/utility tradeoff for each method
-    print(f"Average Utility for POI: {statistics.mean(total_utility_poi):.4f} km")
-    print(f"Average Privacy for POI: {statistics.mean(total_privacy_poi):.4f} km")
-    print(f"Average Utility for Walkable: {statistics.mean(total_utility_osrm):.4f} km")
-    print(f"Average Privacy for Walkable: {statistics.mean(total_privacy_osrm):.4f} km")
+    for method, utility, privacy, adversary_error in store.method_averages(conn, keys):
+        print(f"Average Utility for {method}: {utility:.4f} km")
+        print(f"Average Privacy for {method}: {privacy:.4f} km")
+        if adversary_error is not None:
+            print(f"Average Adversary Error for {method}: {adversary_error:.4f} km")
+    conn.close()
 
     # Create a summary plot of privacy/utility tradeoff for each location, for each method
     plt.figure(figsize=(12, 7))
-    for address, method, utility, privacy in results:
-        color = 'blue' if method == "POI" else 'green'
-        marker = 'o' if method == "POI" else '^'
+    for address, method, utility, privacy, _, _ in results:
+        color, marker = PLOT_STYLES[method]
         plt.scatter(privacy, utility, color=color, marker=marker, label=method if address == results[0][0] else "")
 
         # Annotate each point with the address
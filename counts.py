@@ -0,0 +1,68 @@
+from multiprocessing import Pool
+import numpy as np
+import streams
+
+# Runs above this many only keep per candidate counts and running aggregates
+# Below it the methods keep their run by run output
+COUNTS_ONLY_RUNS = 100000
+
+# Largest number of noisy points written to an output file or drawn on a map
+SAMPLE_POINTS = 1000
+
+# Number of runs at which a counts-only run records its metrics for the graph
+HISTORY_POINTS = 200
+
+# Runs at which the metrics of a long run are recorded, evenly spaced and ending at num_runs
+def checkpoints(num_runs, points=HISTORY_POINTS):
+    return np.unique(np.linspace(1, num_runs, min(points, num_runs)).round().astype(np.int64))
+
+# Picks of one shard between the checkpoints that fall inside it
+# Returns (run, counts) for every checkpoint in the shard and for its last run
+def shard_segments(seed, location, method, shard, num_runs, num_candidates, marks):
+    rng = streams.stream(seed, location, method, shard)
+    start, end = streams.shard_runs(shard, num_runs)
+    uniform = np.full(num_candidates, 1.0 / num_candidates)
+    segments = []
+    for run in sorted({mark for mark in marks if start < mark < end} | {end}):
+        segments.append((run, rng.multinomial(run - start, uniform)))
+        start = run
+    return segments
+
+def _shard_segments(task):
+    return shard_segments(*task)
+
+# Simulate num_runs uniform picks among num_candidates without keeping the picks
+# Yields (run, counts) at every checkpoint, counts is the number of times each candidate
+# was picked so far and is updated in place. The picks between two checkpoints are drawn
+# as one multinomial, which has the same distribution as picking them one at a time, so
+# memory and time depend on the number of candidates and checkpoints and not on the
+# number of runs. Every shard of streams.SHARD_RUNS runs has its own stream for
+# (location, method), so the shards can run in any number of processes and the counts
+# are the same bit for bit.
+def draw(num_runs, num_candidates, seed, location, method, points=HISTORY_POINTS, processes=None):
+    marks = set(checkpoints(num_runs, points).tolist())
+    tasks = [(seed, location, method, shard, num_runs, num_candidates, marks) for shard in range(streams.num_shards(num_runs))]
+    counts = np.zeros(num_candidates, dtype=np.int64)
+    if processes == 1 or len(tasks) == 1:
+        results = map(_shard_segments, tasks)
+        pool = None
+    else:
+        pool = Pool(processes)
+        results = pool.imap(_shard_segments, tasks)
+    try:
+        for segments in results:
+            for run, segment in segments:
+                counts += segment
+                if run in marks:
+                    yield run, counts
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+# Sample of the picks behind a counts array, without replacement
+# Returns how many of the sampled picks went to each candidate, at most size in total
+def sample(counts, size=SAMPLE_POINTS, rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
+    counts = np.asarray(counts, dtype=np.int64)
+    return rng.multivariate_hypergeometric(counts, min(size, int(counts.sum())))
@@ -0,0 +1,79 @@
+import numpy as np
+import spatial
+
+# Distance in km under which two locations of a kind with the same name are one place
+# A shop tagged on both its building and a node is a few meters apart, one street split
+# into many ways has segment centers a block or so apart
+DEDUP_KM = {
+    'poi': 0.05,
+    'walkable': 0.15,
+}
+
+# Group every point with the first point before it that is closer than spacing km
+# When labels is given a point is only compared with kept points of the same label, and
+# points labeled None are always kept. Kept points are hashed into cells of spacing km so
+# each point is only compared with the kept points in the 3x3 block of cells around it,
+# which keeps the whole pass close to linear in the number of points.
+# Returns the index of the kept point each point went to, kept points go to themselves.
+def group(lats, lons, spacing, labels=None):
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    owner = np.arange(len(lats))
+    if not len(lats) or spacing <= 0:
+        return owner
+    x, y = spatial.project(lats, lons, float(lats[0]), float(lons[0]))
+    cx = np.floor(x / spacing).astype(np.int64).tolist()
+    cy = np.floor(y / spacing).astype(np.int64).tolist()
+    x, y = x.tolist(), y.tolist()
+
+    cells = {}
+    for i in range(len(x)):
+        label = labels[i] if labels is not None else 0
+        if label is None:
+            continue
+        close = next((
+            j
+            for dx in (-1, 0, 1)
+            for dy in (-1, 0, 1)
+            for j in cells.get((label, cx[i] + dx, cy[i] + dy), ())
+            if (x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2 < spacing ** 2
+        ), None)
+        if close is not None:
+            owner[i] = close
+        else:
+            cells.setdefault((label, cx[i], cy[i]), []).append(i)
+    return owner
+
+# Keep every point that is at least spacing km away from the points kept before it
+# Returns a boolean array of the points that were kept, see group for labels
+def thin(lats, lons, spacing, labels=None):
+    return group(lats, lons, spacing, labels) == np.arange(len(lats))
+
+# Group the duplicate candidates of a kind
+# Candidates with the same name closer than DEDUP_KM are one place. types are the
+# positions in snapshot.ELEMENT_TYPES, which lists nodes first, so a node leads its group
+# when there is one since it has the exact position of a place.
+# Returns the index of the candidate that leads each candidate's group.
+def group_candidates(kind, types, names, lats, lons):
+    order = np.argsort(np.asarray(types), kind='stable')
+    owner = group(np.take(lats, order), np.take(lons, order), DEDUP_KM[kind], [names[i] for i in order])
+    leaders = np.empty(len(order), dtype=np.int64)
+    leaders[order] = order[owner]
+    return leaders
+
+# One element for a group of duplicates, the first one with the tags it is missing from
+# the others, so opening hours or access tags set on only one of them still count
+def merge_group(elements):
+    merged = dict(elements[0], tags=dict(elements[0].get('tags', {})))
+    for el in elements[1:]:
+        for key, value in el.get('tags', {}).items():
+            merged['tags'].setdefault(key, value)
+    return merged
+
+# Thin elements so no two are closer than spacing km, keeping the first of each pair
+# Runs on the elements a query picked, after policies and opening hours
+def thin_elements(elements, points, spacing):
+    if not elements or not spacing:
+        return elements
+    keep = thin([point[0] for point in points], [point[1] for point in points], spacing)
+    return [el for el, kept in zip(elements, keep.tolist()) if kept]
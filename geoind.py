@@ -0,0 +1,194 @@
+import folium
+from folium import Circle
+import webbrowser
+import os
+import numpy as np
+from collections import Counter
+from hybrid import GetCoordinates, FindPOIs, FindWalkableAreas, calculate_distance
+import spatial
+import adaptive
+import render
+import streams
+
+# Recommended privacy level in 1/km, the average perturbation is 2 / epsilon km
+DEFAULT_EPSILON = 8.0
+
+# Draw points from the planar Laplace distribution centered on (lat, lon)
+# The angle is uniform and the distance follows a gamma distribution with shape 2
+# and scale 1 / epsilon, which is the polar form of the planar Laplace density
+def planar_laplace(lat, lon, epsilon, size=1, rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
+    theta = rng.uniform(0, 2 * np.pi, size)
+    r = rng.gamma(2.0, 1.0 / epsilon, size)
+    return spatial.unproject(r * np.cos(theta), r * np.sin(theta), lat, lon)
+
+# Perturb the user's location and snap every perturbed point to the nearest candidate
+# Returns the positions of the chosen candidates in the index
+def suggest(index, lat, lon, epsilon, size=1, rng=None):
+    noisy_lat, noisy_lon = planar_laplace(lat, lon, epsilon, size, rng)
+    positions, _ = spatial.nearest_batch(index, noisy_lat, noisy_lon)
+    return positions
+
+# Create the map of the suggested candidates
+def create_map(center_lat, center_lon, radius_km, candidates, counts):
+    Map = folium.Map(location=[center_lat, center_lon], zoom_start=13)
+    folium.Marker([center_lat, center_lon], popup="User Location", icon=folium.Icon(color='red')).add_to(Map)
+
+    # Radius chosen by user
+    Circle(
+        location=(center_lat, center_lon),
+        radius=radius_km * 1000,
+        color='blue',
+        fill=True,
+        fill_opacity=0.2
+    ).add_to(Map)
+
+    # Show every candidate that was suggested at least once
+    for position, count in counts.items():
+        name, lat, lon, loc_type = candidates[position]
+        folium.CircleMarker(
+            location=[lat, lon],
+            radius=3,
+            color='green' if loc_type == 'poi' else 'orange',
+            fill=True,
+            fill_opacity=1,
+            popup=f"{name}<br>Suggested: {count}"
+        ).add_to(Map)
+
+    Map.save("GeoInd_Map.html")
+    webbrowser.open('file://' + os.path.realpath("GeoInd_Map.html"))
+
+# Write to a text file every suggested location in the order it was suggested
+def save_to_file(candidates, positions, filename="GeoInd.txt", runs_used=None):
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write("Geo-indistinguishable suggestions:\n\n")
+        for position in positions:
+            name, lat, lon, _ = candidates[position]
+            f.write(f"{name}: ({lat}, {lon})\n")
+        if runs_used is not None:
+            f.write(f"Runs used: {runs_used}\n")
+
+def main():
+    # From the user get an address or coordinates for their chosen location
+    ch = input("Type 'Address' or 'Coordinates': ").strip().lower()
+    if ch == 'address':
+        address = input("Enter address: ")
+        coords = GetCoordinates(address)
+        if not coords:
+            print("Address not found")
+            return
+        location = address
+    elif ch == 'coordinates':
+        try:
+            lat = float(input("Latitude: "))
+            lon = float(input("Longitude: "))
+            coords = (lat, lon)
+        except ValueError:
+            print("Invalid Coordinates")
+            return
+        location = f"{lat},{lon}"
+    else:
+        print("Invalid Entry")
+        return
+
+    # From the user get the radius of the circle
+    try:
+        radius = float(input("Radius (KM): "))
+    except ValueError:
+        print("Invalid Radius")
+        return
+
+    # From the user get the privacy level
+    try:
+        epsilon = float(input(f"Enter epsilon (1/KM) ({DEFAULT_EPSILON} is a recommended value): "))
+        if epsilon <= 0:
+            raise ValueError
+    except ValueError:
+        print("Invalid Epsilon")
+        return
+
+    # From the user get the number of runs, 'auto' keeps running until the estimates are precise enough
+    precision = None
+    try:
+        runs_input = input("Enter number of runs (or 'auto'): ").strip().lower()
+        if runs_input == 'auto':
+            precision = float(input(f"Enter target precision (KM) ({adaptive.DEFAULT_PRECISION} is a recommended value): "))
+        else:
+            num_runs = int(runs_input)
+    except ValueError:
+        print("Invalid number of runs")
+        return
+
+    # From the user get the seed, the same seed, location and inputs always give the same suggestions
+    try:
+        seed = streams.parse_seed(input("Enter seed (blank for random): "))
+    except ValueError:
+        print("Invalid Seed")
+        return
+    print(f"Seed: {seed}")
+    rng = streams.stream(seed, location, "GeoInd")
+
+    # Both POIs and walkable areas are candidates to snap to
+    candidates = FindPOIs(coords[0], coords[1], radius) + FindWalkableAreas(coords[0], coords[1], radius)
+    if not candidates:
+        print("No locations found within the specified radius.")
+        return
+    print(f"Found {len(candidates)} candidate locations.")
+
+    # Index the candidates once and snap every run in one batch
+    index = spatial.build_index([(float(c[1]), float(c[2])) for c in candidates], ref=coords)
+
+    # Adaptive mode snaps runs in blocks and stops once the privacy and utility are within the precision
+    if precision is not None:
+        result = adaptive.estimate(
+            coords[0], coords[1], [(float(c[1]), float(c[2])) for c in candidates], precision,
+            rng=rng, draw=lambda size, rng: suggest(index, coords[0], coords[1], epsilon, size, rng)
+        )
+        print(f"Used {result['runs']} runs")
+        print(f"Privacy = {result['privacy']} +/- {result['privacy_ci']}")
+        print(f"Utility = {result['utility']} +/- {result['utility_ci']}")
+
+        counts = result['counts']
+        # The map and text files are written in the background
+        render.submit(save_to_file, candidates, np.repeat(np.arange(len(candidates)), counts), runs_used=result['runs'],
+                      callback=render.announce("GeoInd.txt"))
+        render.submit(create_map, coords[0], coords[1], radius, candidates,
+                      {p: c for p, c in enumerate(counts.tolist()) if c > 0}, callback=render.announce("GeoInd_Map.html"))
+        return
+
+    positions = suggest(index, coords[0], coords[1], epsilon, num_runs, rng)
+
+    chosen_lat = np.array([float(candidates[p][1]) for p in positions])
+    chosen_lon = np.array([float(candidates[p][2]) for p in positions])
+    runs = np.arange(1, num_runs + 1)
+
+    # Utility is the running average walking distance to the suggestions
+    distances = np.array([calculate_distance(coords[0], coords[1], a, b) for a, b in zip(chosen_lat, chosen_lon)])
+    utility_values = np.cumsum(distances) / runs
+
+    # Privacy is the distance from the running centroid of the suggestions to the user
+    centroid_lat = np.cumsum(chosen_lat) / runs
+    centroid_lon = np.cumsum(chosen_lon) / runs
+    privacy_values = [calculate_distance(coords[0], coords[1], a, b) for a, b in zip(centroid_lat, centroid_lon)]
+
+    for x in range(num_runs):
+        print(f"Iteration {x + 1}: Selected {candidates[positions[x]][0]}")
+        print(f"Privacy = {privacy_values[x]}")
+        print(f"Utility = {utility_values[x]}")
+        print("")
+
+    # Create the map, text files and graph in the background so the results above are not held up
+    render.submit(save_to_file, candidates, positions, callback=render.announce("GeoInd.txt"))
+    render.submit(create_map, coords[0], coords[1], radius, candidates, Counter(positions.tolist()),
+                  callback=render.announce("GeoInd_Map.html"))
+
+    # Plot the privacy and utility vs iteration
+    render.submit(render.plot_runs, "GeoInd_Utility_Privacy_Graph", runs, [
+        (utility_values, 'green', 'Utility vs Iteration', 'Utility (Avg Distance to Suggestions)'),
+        (privacy_values, 'red', 'Privacy vs Iteration', 'Privacy (Distance to Centroid of Suggestions)'),
+    ], show=True, callback=render.announce("GeoInd_Utility_Privacy_Graph.png"))
+
+if __name__ == "__main__":
+    main()
+    render.wait()
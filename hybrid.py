@@ -3,16 +3,24 @@ from geopy.geocoders import Nominatim
 from folium import Circle # helps create the interactive map
 import webbrowser 
 import os
-import requests # making http request to OpenStreetMaps
 import re
-import random
 from collections import defaultdict
 import warnings
 import math
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import pandas as pd
+import numpy as np
+import adversary
+import adaptive
+import osm_cache
+import tags
+import kanon
+import opening_hours
+import render
+import counts
+import streams
 
-OVERPASS_URL = "http://overpass-api.de/api/interpreter"
 os.environ["OMP_NUM_THREADS"] = "1"
 warnings.filterwarnings(
     "ignore",
@@ -31,31 +39,10 @@ def GetCoordinates(address):
         return None
 
 # Queiries OpenStreetMaps Overpass API to find POIs
-def FindPOIs(lat, lon, rad):
+def FindPOIs(lat, lon, rad, policy=None, open_at=None, spacing=None):
     # finds amentities, tourism, leisure, and shop tags 
-    query = f"""
-    [out:json];
-    (
-      node["amenity"](around:{rad * 1000},{lat},{lon});
-      node["tourism"](around:{rad * 1000},{lat},{lon});
-      node["leisure"](around:{rad * 1000},{lat},{lon});
-      node["shop"](around:{rad * 1000},{lat},{lon});
-
-      way["amenity"](around:{rad * 1000},{lat},{lon});
-      way["tourism"](around:{rad * 1000},{lat},{lon});
-      way["leisure"](around:{rad * 1000},{lat},{lon});
-      way["shop"](around:{rad * 1000},{lat},{lon});
-
-      relation["amenity"](around:{rad * 1000},{lat},{lon});
-      relation["tourism"](around:{rad * 1000},{lat},{lon});
-      relation["leisure"](around:{rad * 1000},{lat},{lon});
-      relation["shop"](around:{rad * 1000},{lat},{lon});
-    );
-    out center tags;
-    """
-    # puts the pois found into a lists
-    response = requests.get(OVERPASS_URL, params={'data': query})
-    data = response.json()
+    # uses the tile cache when it covers the radius
+    data = {'elements': osm_cache.fetch_elements('poi', lat, lon, rad, policy, open_at, spacing)}
     pois = []
     for el in data['elements']:
         name = el.get('tags', {}).get('name', 'Unnamed POI')
@@ -75,17 +62,9 @@ def FindPOIs(lat, lon, rad):
     return pois
 
 # querires OpenStreetMaps for walkable areas along a road or trail
-def FindWalkableAreas(lat, lon, rad):
-    query = f"""
-    [out:json];
-    (
-      way["highway"](around:{rad * 1000},{lat},{lon})
-        ["highway"!~"motorway|motorway_link"];
-    );
-    out center tags;
-    """
-    response = requests.get(OVERPASS_URL, params={'data': query})
-    data = response.json()
+def FindWalkableAreas(lat, lon, rad, policy=None, spacing=None):
+    # uses the tile cache when it covers the radius
+    data = {'elements': osm_cache.fetch_elements('walkable', lat, lon, rad, policy, spacing=spacing)}
     # puts the walkable locations into a list with longitude and latitude
     walkable_areas = []
     for el in data['elements']:
@@ -192,21 +171,36 @@ def make_graph(csv_file):
         # 
         df = pd.read_csv(csv_file)
         # creates the graph with the privacy and utility
-        plt.figure(figsize=(10, 6))
-        plt.plot(df['Run'], df['Privacy(km)'], marker='o', linestyle='-', color='blue', label='Privacy')
-        plt.plot(df['Run'], df['Utility(km)'], marker='s', linestyle='-', color='green', label='Utility')
-        plt.title('Privacy and Utility Metrics Over Multiple Runs', fontsize=14)
-        plt.xlabel('Number of Locations Chosen', fontsize=12)
-        plt.ylabel('Distance (km)', fontsize=12)
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.legend()
+        # uses the figure directly instead of pyplot so it can be drawn in the background
+        fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.plot(df['Run'], df['Privacy(km)'], marker='o', linestyle='-', color='blue', label='Privacy')
+        ax.plot(df['Run'], df['Utility(km)'], marker='s', linestyle='-', color='green', label='Utility')
+        if 'Adversary(km)' in df:
+            ax.plot(df['Run'], df['Adversary(km)'], marker='^', linestyle='-', color='purple', label='Adversary Error')
+        ax.set_title('Privacy and Utility Metrics Over Multiple Runs', fontsize=14)
+        ax.set_xlabel('Number of Locations Chosen', fontsize=12)
+        ax.set_ylabel('Distance (km)', fontsize=12)
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.legend()
         # saves the graph a png file
-        plt.savefig('hybrid_graph.png', dpi=300)
-        plt.close()
+        fig.savefig('hybrid_graph.png', dpi=300)
     # if the graph was not created then it returns an error
     except Exception as e:
         print(f"Error creating graphs: {e}")
 
+# saves the final metrics and every suggested location with the amount of times it was suggested
+def save_results(filename, metrics, location_counter):
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("Final Utility and Privacy Metrics:\n")
+        for line in metrics:
+            file.write(f"{line}\n")
+        file.write("\nSuggested locations:\n")
+        for loc_key, count in location_counter.items():
+            if count > 0:
+                file.write(f"{loc_key} -> suggested {count} times\n")
+
 # this reads a text file for location data needed
 def parse_config_file(filename):
     try:
@@ -231,7 +225,29 @@ def parse_config_file(filename):
             elif key == 'address':
                 config[key] = value
             elif key == 'num_runs':
+                # 'auto' keeps running until the estimates reach the precision
+                config[key] = value.lower() if value.lower() == 'auto' else int(value)
+            # k has to be at least 1, there is no smallest radius with no locations
+            elif key == 'k':
                 config[key] = int(value)
+                if config[key] < 1:
+                    raise ValueError(f"k must be at least 1, got {value}")
+            elif key == 'max_radius':
+                config[key] = float(value)
+            # smallest distance in km between two suggested locations, closer ones are thinned out
+            elif key == 'min_spacing':
+                config[key] = float(value)
+            elif key == 'precision':
+                config[key] = float(value)
+            # the same seed and inputs always give the same suggestions
+            elif key == 'seed':
+                config[key] = streams.parse_seed(value)
+            # 'now' or a day and time like 'Tu 14:30', only pois open then are suggested
+            elif key == 'open_at':
+                config[key] = value
+            # comma separated tags from tags.TAG_BITS that candidates must have or must not have
+            elif key in ['allow', 'deny']:
+                config[key] = [tag.strip() for tag in value.split(',') if tag.strip()]
                 
         return config
     # if the file was not read returns error
@@ -267,31 +283,77 @@ def Main():
     # gets the num of times this would be ran for that one location
     num_runs = config.get('num_runs', 10)
     
+    # gets the seed, a new one is made and printed when the file does not have one
+    seed = config['seed'] if 'seed' in config else streams.new_seed()
+    # each location gets its own random stream
+    location = config['address'] if config.get('location_type') == 'address' else f"{coords[0]},{coords[1]}"
+    rng = streams.stream(seed, location, "Hybrid")
+
     print(f"Using coordinates: {coords}")
     print(f"Radius: {radius} km")
     print(f"Number of runs: {num_runs}")
+    print(f"Seed: {seed}")
     
-    # finds all the pois and walkable locations in the radius
-    pois = FindPOIs(coords[0], coords[1], radius)
-    walkable_areas = FindWalkableAreas(coords[0], coords[1], radius)
-    
-    print(f"Found {len(pois)} POIs and {len(walkable_areas)} walkable areas.")
-    
+    # compiles the allow and deny tags into bitmask policies for each kind of location
+    # and finds the opening hours slot pois have to be open in
+    try:
+        poi_policy = tags.make_policy('poi', config.get('allow', []), config.get('deny', []))
+        walkable_policy = tags.make_policy('walkable', config.get('allow', []), config.get('deny', []))
+        open_at = opening_hours.parse_slot(config['open_at']) if 'open_at' in config else None
+    except ValueError as e:
+        print(e)
+        return
+
+    # duplicates of the same place are always dropped, min_spacing also thins out the rest
+    spacing = config.get('min_spacing')
+
     locations_to_use = []
     location_keys = []
-    
-    # when there are not atleast 20 pois then it picks pois
-    if len(pois) >= 20:
-        print("Using only POIs since there at at least 20 in area!")
-        locations_to_use = pois
+    find_pois = lambda lat, lon, rad: FindPOIs(lat, lon, rad, poi_policy, open_at, spacing)
+    find_all = lambda lat, lon, rad: (FindPOIs(lat, lon, rad, poi_policy, open_at, spacing)
+                                      + FindWalkableAreas(lat, lon, rad, walkable_policy, spacing))
+
+    # with k set, the radius is the smallest one that has k locations, up to max_radius
+    if 'k' in config:
+        k = config['k']
+        max_radius = config.get('max_radius', radius)
+
+        # prefers pois like the default mode and only adds walkable locations when needed
+        find_locations = find_pois
+        radius, locations_to_use, met = kanon.adaptive_radius(coords[0], coords[1], k, max_radius, find_pois, ('poi',))
+        if met:
+            print(f"Found {k} POIs within {radius:.4f} km.")
+        else:
+            print(f"Only {len(locations_to_use)} POIs within {max_radius} km. Adding walkable areas.")
+            find_locations = find_all
+            radius, locations_to_use, met = kanon.adaptive_radius(
+                coords[0], coords[1], k, max_radius, find_all, ('poi', 'walkable')
+            )
+            if met:
+                print(f"Found {k} locations within {radius:.4f} km.")
+            else:
+                print(f"Only {len(locations_to_use)} locations within {max_radius} km, fewer than k = {k}")
     else:
-        # if there arent 20 pois it picks between pois and walkable locations
-        print(f"Only {len(pois)} POIs found. Adding walkable areas.")
-        locations_to_use = pois + walkable_areas
+        # finds all the pois and walkable locations in the radius
+        pois = FindPOIs(coords[0], coords[1], radius, poi_policy, open_at, spacing)
+        walkable_areas = FindWalkableAreas(coords[0], coords[1], radius, walkable_policy, spacing)
+    
+        print(f"Found {len(pois)} POIs and {len(walkable_areas)} walkable areas.")
+    
+        # when there are not atleast 20 pois then it picks pois
+        if len(pois) >= 20:
+            print("Using only POIs since there at at least 20 in area!")
+            locations_to_use = pois
+            find_locations = find_pois
+        else:
+            # if there arent 20 pois it picks between pois and walkable locations
+            print(f"Only {len(pois)} POIs found. Adding walkable areas.")
+            locations_to_use = pois + walkable_areas
+            find_locations = find_all
         
-        # when there are not enough walkable locations or pois in the radius
-        if len(locations_to_use) < 5:
-            print(f"Not enough locations to use")
+            # when there are not enough walkable locations or pois in the radius
+            if len(locations_to_use) < 5:
+                print(f"Not enough locations to use")
     # cant be used if no locations other than the users to pick from
     if not locations_to_use:
         print("No locations found within the specified radius.")
@@ -304,60 +366,119 @@ def Main():
         location_keys.append(key)
         location_dict[key] = loc
     
+    # precomputes the bayesian adversary over a grid around the user
+    # the cells away from the user also reach locations past the radius, found the same way
+    area_locations = find_locations(coords[0], coords[1], adversary.area_radius(radius))
+    adversary_model = adversary.build_model(
+        coords[0], coords[1], radius, [(float(loc[1]), float(loc[2])) for loc in locations_to_use],
+        area=[(float(loc[1]), float(loc[2])) for loc in area_locations]
+    )
+    adversary_counts = np.zeros(len(location_keys))
+    adversary_error = 0.0
+    utility = 0.0
+    privacy = 0.0
+
+    # adaptive mode draws runs in blocks until the privacy and utility are within the precision
+    if num_runs == 'auto':
+        result = adaptive.estimate(
+            coords[0], coords[1], [(float(loc[1]), float(loc[2])) for loc in locations_to_use],
+            config.get('precision', adaptive.DEFAULT_PRECISION), rng=rng
+        )
+        location_counter = {key: count for key, count in zip(location_keys, result['counts'].tolist()) if count > 0}
+        adversary_error = adversary.expected_error(adversary_model, result['counts'])
+        print(f"Used {result['runs']} runs")
+        print(f"  - Utility: {result['utility']:.4f} +/- {result['utility_ci']:.4f} km")
+        print(f"  - Privacy: {result['privacy']:.4f} +/- {result['privacy_ci']:.4f} km")
+        print(f"  - Adversary Error: {adversary_error:.4f} km")
+
+        # the map and the final results file are written in the background
+        render.submit(CreateMap, coords[0], coords[1], radius, locations_to_use, location_counter,
+                      callback=render.announce("hybrid_map.html"))
+        render.submit(save_results, "hybrid_locations.txt", [
+            f"Runs used: {result['runs']}",
+            f"Utility: {result['utility']:.4f} +/- {result['utility_ci']:.4f} km",
+            f"Privacy: {result['privacy']:.4f} +/- {result['privacy_ci']:.4f} km",
+            f"Adversary Error: {adversary_error:.4f} km",
+        ], location_counter, callback=render.announce("hybrid_locations.txt"))
+        return
+
     # creates a file to store the data of each location found and privacy and utility
     with open("hybrid_data.csv", "w", encoding="utf-8") as metrics_file:
-        metrics_file.write("Run,Location,Utility(km),Privacy(km)\n")
+        metrics_file.write("Run,Location,Utility(km),Privacy(km),Adversary(km)\n")
         
-        # creates empty list of locations picked
-        chosen_locations = []
-        location_counter = defaultdict(int)
+        # long runs only keep how many times each location was picked and write the metrics
+        # at checkpoints, so memory and the csv file do not grow with the number of runs
+        if num_runs > counts.COUNTS_ONLY_RUNS:
+            loc_lat = np.array([float(loc[1]) for loc in locations_to_use])
+            loc_lon = np.array([float(loc[2]) for loc in locations_to_use])
+            for run, run_counts in counts.draw(num_runs, len(location_keys), seed, location, "Hybrid"):
+                # the same utility and privacy as the functions above compute from the full list of picks
+                weights = run_counts / run
+                centroid_lat = weights @ loc_lat
+                centroid_lon = weights @ loc_lon
+                if run == 1:
+                    utility = osm_cache.calculate_distance(coords[0], coords[1], centroid_lat, centroid_lon)
+                else:
+                    utility = weights @ osm_cache.calculate_distance(centroid_lat, centroid_lon, loc_lat, loc_lon)
+                privacy = osm_cache.calculate_distance(coords[0], coords[1], centroid_lat, centroid_lon)
+                adversary_error = adversary.expected_error(adversary_model, run_counts)
+                metrics_file.write(f'{run},"",{utility:.4f},{privacy:.4f},{adversary_error:.4f}\n')
+
+                print(f"Run {run}:")
+                print(f"  - Utility: {utility:.4f} km")
+                print(f"  - Privacy: {privacy:.4f} km")
+                print(f"  - Adversary Error: {adversary_error:.4f} km")
+            location_counter = {key: count for key, count in zip(location_keys, run_counts.tolist()) if count > 0}
+        else:
+            # creates empty list of locations picked
+            chosen_locations = []
+            location_counter = defaultdict(int)
         
-        # runs for the number of times they want a location
-        for run in range(1, num_runs + 1):
-            # picks random location
-            chosen_key = random.choice(location_keys)
-            chosen_location = location_dict[chosen_key]
-            location_counter[chosen_key] += 1
+            # runs for the number of times they want a location
+            for run in range(1, num_runs + 1):
+                # picks random location
+                chosen_index = int(rng.integers(len(location_keys)))
+                chosen_key = location_keys[chosen_index]
+                chosen_location = location_dict[chosen_key]
+                location_counter[chosen_key] += 1
+                adversary_counts[chosen_index] += 1
             
-            # adds chosen location to lists
-            chosen_locations.append(chosen_location)
+                # adds chosen location to lists
+                chosen_locations.append(chosen_location)
             
-            #  calculates utility and privacy
-            utility = calculate_utility_distance(
-                coords[0], coords[1], chosen_locations
-            )
-            privacy = calculate_privacy_distance(
-                coords[0], coords[1], chosen_locations
-            )
-            # writes the utility and privacy to file after each new location
-            metrics_file.write(
-                f'{run},"{chosen_key}",{utility:.4f},{privacy:.4f}\n'
-            )
+                #  calculates utility and privacy
+                utility = calculate_utility_distance(
+                    coords[0], coords[1], chosen_locations
+                )
+                privacy = calculate_privacy_distance(
+                    coords[0], coords[1], chosen_locations
+                )
+                # expected distance between the adversary's best guesses and the user
+                adversary_error = adversary.expected_error(adversary_model, adversary_counts)
+                # writes the utility and privacy to file after each new location
+                metrics_file.write(
+                    f'{run},"{chosen_key}",{utility:.4f},{privacy:.4f},{adversary_error:.4f}\n'
+                )
             
-            print(f"Run {run}: Selected {chosen_location[0]}")
-            print(f"  - Utility: {utility:.4f} km")
-            print(f"  - Privacy: {privacy:.4f} km")
-    
-    # creates a map of the each suggested location 
-    CreateMap(coords[0], coords[1], radius, locations_to_use, location_counter)
+                print(f"Run {run}: Selected {chosen_location[0]}")
+                print(f"  - Utility: {utility:.4f} km")
+                print(f"  - Privacy: {privacy:.4f} km")
+                print(f"  - Adversary Error: {adversary_error:.4f} km")
 
-    # creates a graph of the privacy vs utility
-    make_graph("hybrid_data.csv")
-    
-    # calculates the utility and privacy scores based on chosen locations
-    final_utility = calculate_utility_distance(coords[0], coords[1], chosen_locations)
-    final_privacy = calculate_privacy_distance(coords[0], coords[1], chosen_locations)
-    
-    # saves the final results to a file
-    with open("hybrid_locations.txt", "w", encoding="utf-8") as file:
-        file.write("Final Utility and Privacy Metrics:\n")
-        file.write(f"Utility: {final_utility:.4f} km\n")
-        file.write(f"Privacy: {final_privacy:.4f} km\n\n")
-        # adds in every suggested location generated and the amount of times that the location was suggested
-        file.write("Suggested locations:\n")
-        for loc_key, count in location_counter.items():
-            if count > 0:
-                file.write(f"{loc_key} -> suggested {count} times\n")
+    # the final utility and privacy scores are the ones of the last run
+    final_utility = utility
+    final_privacy = privacy
+
+    # the map, graph and final results file are written in the background so the results above are not held up
+    render.submit(CreateMap, coords[0], coords[1], radius, locations_to_use, location_counter,
+                  callback=render.announce("hybrid_map.html"))
+    render.submit(make_graph, "hybrid_data.csv", callback=render.announce("hybrid_graph.png"))
+    render.submit(save_results, "hybrid_locations.txt", [
+        f"Utility: {final_utility:.4f} km",
+        f"Privacy: {final_privacy:.4f} km",
+        f"Adversary Error: {adversary_error:.4f} km",
+    ], location_counter, callback=render.announce("hybrid_locations.txt"))
 
 if __name__ == "__main__":
     Main()
+    render.wait()
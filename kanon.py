@@ -0,0 +1,31 @@
+from itertools import islice
+import osm_cache
+import spatial
+
+# First radius tried, as a fraction of the maximum walking radius
+START_FRACTION = 0.25
+
+# Find the smallest radius around (lat, lon) with at least k candidate locations
+# find(lat, lon, rad) returns locations as (name, lat, lon, type) tuples, kinds are the
+# osm_cache kinds it reads. The search starts at a small radius and doubles it up to
+# max_radius. Every step only fetches the tiles that are not cached yet, which is the
+# ring added around the previous circle, and the nearest neighbor search stops after k.
+# Returns the radius, the locations within it, and whether k was reached.
+def adaptive_radius(lat, lon, k, max_radius, find, kinds, start_radius=None):
+    radius = min(start_radius or max_radius * START_FRACTION, max_radius)
+    while True:
+        osm_cache.prefetch_circles([(lat, lon, radius)], kinds)
+        # Each circle holds the one before it, so the last result is the whole set. Spacing
+        # and duplicates are thinned over that result and not across steps.
+        locations = find(lat, lon, radius)
+
+        if len(locations) >= k:
+            index = spatial.build_index([(float(loc[1]), float(loc[2])) for loc in locations], ref=(lat, lon))
+            kth_distance = list(islice(spatial.iter_nearest(index, lat, lon), k))[-1][1]
+            # Locations tied with the k-th one are inside the radius too
+            inside = spatial.within(index, lat, lon, kth_distance)
+            return kth_distance, [locations[p] for p in inside], True
+
+        if radius >= max_radius:
+            return max_radius, locations, False
+        radius = min(radius * 2, max_radius)
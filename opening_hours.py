@@ -0,0 +1,139 @@
+import re
+from datetime import datetime
+import numpy as np
+
+# A week is split into 15 minute slots, one bit per slot
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+WEEK_SLOTS = 7 * SLOTS_PER_DAY
+WEEK_BYTES = WEEK_SLOTS // 8
+
+DAYS = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']
+
+# Locations with no opening_hours tag, or a value this parser does not understand,
+# are treated as always open. Most of them are parks, streets and other places
+# without hours, and leaving them out would throw away good candidates.
+UNKNOWN_OPEN = True
+
+# Bitset of a location that is always open or always closed
+ALWAYS_OPEN = np.packbits(np.ones(WEEK_SLOTS, dtype=bool), bitorder='little')
+ALWAYS_CLOSED = np.zeros(WEEK_BYTES, dtype=np.uint8)
+
+DAY_RE = r"(?:Mo|Tu|We|Th|Fr|Sa|Su)"
+TIME_RE = r"\d{1,2}:\d{2}"
+
+# Days of a selector like 'Mo-Fr', 'Mo,We,Fr' or 'Fr-Mo'
+def parse_days(selector):
+    days = []
+    for part in selector.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = (DAYS.index(day) for day in part.split('-'))
+            days += [(start + i) % 7 for i in range((end - start) % 7 + 1)]
+        else:
+            days.append(DAYS.index(part))
+    return days
+
+# Minutes since midnight of a time like '08:30', '24:00' is the end of the day
+# Raises ValueError for anything past 24:00 or with more than 59 minutes
+def parse_minutes(value):
+    hours, minutes = (int(part) for part in value.split(':'))
+    if not (0 <= hours <= 24 and 0 <= minutes <= 59) or (hours == 24 and minutes):
+        raise ValueError(f"Invalid time {value}")
+    return hours * 60 + minutes
+
+# Parse an opening_hours value into a weekly bitset of WEEK_BYTES bytes
+# Supports '24/7', rules separated by ';' or ', ' like 'Mo-Fr 08:00-18:00; Sa 09:00-13:00',
+# several time spans per rule, spans past midnight and 'off'. Later rules replace earlier
+# ones for the days they name, as in OSM. Public holiday rules are skipped because the
+# date is not known. Returns None for anything else.
+def parse(value):
+    value = value.strip()
+    if value == '24/7':
+        return ALWAYS_OPEN.copy()
+
+    week = np.zeros((7, SLOTS_PER_DAY), dtype=bool)
+    spill = np.zeros((7, SLOTS_PER_DAY), dtype=bool)
+    # A comma starts a new rule only after a time or 'off', 'Mo,We 10:00-12:00' is one rule
+    next_rule = rf",\s*(?={DAY_RE}\b|PH\b)"
+    rules = re.split(rf";|(?<=\d){next_rule}|(?<=off){next_rule}|(?<=closed){next_rule}", value)
+    for rule in rules:
+        rule = rule.strip()
+        if not rule:
+            continue
+        if rule.startswith('PH'):
+            continue
+        match = re.fullmatch(
+            rf"({DAY_RE}(?:-{DAY_RE})?(?:,{DAY_RE}(?:-{DAY_RE})?)*)?\s*"
+            rf"(off|closed|{TIME_RE}-{TIME_RE}(?:,\s*{TIME_RE}-{TIME_RE})*)?",
+            rule
+        )
+        if not match or not any(match.groups()):
+            return None
+        days = parse_days(match.group(1)) if match.group(1) else list(range(7))
+        spans = match.group(2) or '00:00-24:00'
+
+        for day in days:
+            week[day] = False
+            spill[(day + 1) % 7] = False
+        if spans in ('off', 'closed'):
+            continue
+
+        for span in spans.split(','):
+            try:
+                start, end = (parse_minutes(t) for t in span.strip().split('-'))
+            except ValueError:
+                return None
+            first = start // SLOT_MINUTES
+            # Spans that end at or before they start continue into the next day
+            if end <= start:
+                end += 24 * 60
+            last = -(-end // SLOT_MINUTES)
+            for day in days:
+                week[day, first:min(last, SLOTS_PER_DAY)] = True
+                if last > SLOTS_PER_DAY:
+                    spill[(day + 1) % 7, :last - SLOTS_PER_DAY] = True
+
+    return np.packbits((week | spill).ravel(), bitorder='little')
+
+# Bitsets of a list of elements as a (len(elements), WEEK_BYTES) array
+# Each distinct value is parsed only once since many places share the same hours
+def compile_elements(elements):
+    unknown = ALWAYS_OPEN if UNKNOWN_OPEN else ALWAYS_CLOSED
+    parsed = {}
+    hours = np.empty((len(elements), WEEK_BYTES), dtype=np.uint8)
+    for i, el in enumerate(elements):
+        value = el.get('tags', {}).get('opening_hours')
+        if value is None:
+            hours[i] = unknown
+            continue
+        if value not in parsed:
+            bits = parse(value)
+            parsed[value] = unknown if bits is None else bits
+        hours[i] = parsed[value]
+    return hours
+
+# Slot of a weekday (0 is Monday) and time of day
+def slot_of(weekday, hour, minute):
+    return weekday * SLOTS_PER_DAY + (hour * 60 + minute) // SLOT_MINUTES
+
+# Slot of a time written as 'now' or like 'Tu 14:30'
+def parse_slot(value):
+    value = value.strip()
+    if value.lower() == 'now':
+        now = datetime.now()
+        return slot_of(now.weekday(), now.hour, now.minute)
+    match = re.fullmatch(rf"({DAY_RE})\s+({TIME_RE})", value)
+    if not match:
+        raise ValueError(f"Invalid time {value}, use 'now' or a day and time like 'Tu 14:30'")
+    hour, minute = (int(part) for part in match.group(2).split(':'))
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        raise ValueError(f"Invalid time {value}, hours go from 00 to 23 and minutes from 00 to 59")
+    return slot_of(DAYS.index(match.group(1)), hour, minute)
+
+# Which locations are open at each of a batch of slots
+# Returns a (len(slots), len(hours)) boolean array using only bit operations
+def open_mask(hours, slots):
+    slots = np.asarray(slots, dtype=np.int64).reshape(-1)
+    bits = hours[:, slots // 8] >> (slots % 8).astype(np.uint8)
+    return (bits & 1).astype(bool).T
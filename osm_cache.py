@@ -0,0 +1,280 @@
+import json
+import math
+import os
+import numpy as np
+import requests
+import tags
+import opening_hours
+import snapshot
+import dedup
+
+# Using the Overpass API for mapping
+OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+
+# Folder that holds the cached tiles
+CACHE_DIR = ".osm_cache"
+
+# Version of the cached tiles, tiles written by another version are fetched again
+# Since version 3 the tiles are kept in the binary snapshots of snapshot.py instead of
+# one JSON file per tile. Since version 5 tiles keep every element as fetched and
+# duplicates are merged when candidates are read
+TILE_VERSION = 5
+
+# Folder of the snapshots, each version has its own
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, f"v{TILE_VERSION}")
+
+# Size of a cache tile in degrees, about 2 km north to south
+TILE_DEG = 0.02
+
+# Largest number of tiles along each side of a single bbox query
+BLOCK_TILES = 4
+
+# Radius of the earth in km, same value the haversine functions use
+EARTH_RADIUS = 6371.0
+
+# Overpass filters for each kind of candidate
+# Motorways are fetched too and left out by the default policy in tags.py, so a policy
+# change never needs a new query
+QUERY_FILTERS = {
+    'poi': [
+        f'{element}["{key}"]'
+        for element in ('node', 'way', 'relation')
+        for key in ('amenity', 'tourism', 'leisure', 'shop')
+    ],
+    'walkable': [
+        'way["highway"]',
+    ],
+}
+
+# Compiled tiles that were loaded in this process, keyed by (kind, tile)
+_tiles = {}
+
+# Tile that holds a coordinate
+def tile_of(lat, lon):
+    return (math.floor(lat / TILE_DEG), math.floor(lon / TILE_DEG))
+
+# South, west, north and east edges of a tile
+def tile_bounds(tile):
+    return (tile[0] * TILE_DEG, tile[1] * TILE_DEG, (tile[0] + 1) * TILE_DEG, (tile[1] + 1) * TILE_DEG)
+
+# Every tile that overlaps the bounding box of a circle of rad km
+def tiles_for_circle(lat, lon, rad):
+    dlat = math.degrees(rad / EARTH_RADIUS)
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    south, west = tile_of(lat - dlat, lon - dlon)
+    north, east = tile_of(lat + dlat, lon + dlon)
+    return {(i, j) for i in range(south, north + 1) for j in range(west, east + 1)}
+
+# Coordinate of an element, ways and relations use their center
+def element_point(el):
+    lat = el.get('lat')
+    lon = el.get('lon')
+    if lat is None or lon is None:
+        center = el.get('center')
+        if center:
+            lat = center.get('lat')
+            lon = center.get('lon')
+    return lat, lon
+
+# Kinds of candidate an element counts as, matching QUERY_FILTERS
+def element_kinds(el):
+    tags = el.get('tags', {})
+    kinds = []
+    if any(key in tags for key in ('amenity', 'tourism', 'leisure', 'shop')):
+        kinds.append('poi')
+    if el.get('type') == 'way' and 'highway' in tags:
+        kinds.append('walkable')
+    return kinds
+
+# Haversine formula for finding the distance between two coordinates, works on numpy arrays
+def calculate_distance(lat1, lon1, lat2, lon2):
+    dLat = np.radians(lat2 - lat1)
+    dLon = np.radians(lon2 - lon1)
+    a = np.sin(dLat / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dLon / 2) ** 2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+# Turn a list of elements into candidate arrays
+# The coordinates, tag masks and opening hours are compiled once here so distance
+# checks, policies and open checks are numpy operations over the whole tile
+def compile_tile(elements):
+    elements = [el for el in elements if element_point(el)[0] is not None and element_point(el)[1] is not None]
+    points = np.array([element_point(el) for el in elements], dtype=float).reshape(-1, 2)
+    return {
+        'elements': elements,
+        'type': np.array([snapshot.ELEMENT_TYPES.index(el.get('type', 'node')) for el in elements], dtype=np.uint8),
+        'name': [el.get('tags', {}).get('name') for el in elements],
+        'lat': points[:, 0],
+        'lon': points[:, 1],
+        'mask': tags.compile_elements(elements),
+        'hours': opening_hours.compile_elements(elements),
+    }
+
+# Send a query to Overpass and return the elements
+def overpass(query, timeout=180):
+    response = requests.get(OVERPASS_URL, params={'data': query}, timeout=timeout)
+    response.raise_for_status()
+    return response.json().get('elements', [])
+
+# Query for every candidate of a kind inside a bounding box
+def bbox_query(kind, south, west, north, east):
+    lines = "\n".join(f"      {f}({south},{west},{north},{east});" for f in QUERY_FILTERS[kind])
+    return f"""
+    [out:json][timeout:180];
+    (
+{lines}
+    );
+    out center tags;
+    """
+
+# Compiled candidates of a cached tile, or None when the tile was never fetched
+# Tiles are slices of the memory mapped snapshot, so a cold start reads no JSON
+def load_tile(kind, tile):
+    if (kind, tile) in _tiles:
+        return _tiles[(kind, tile)]
+    compiled = snapshot.load_tile(SNAPSHOT_DIR, kind, tile)
+    if compiled is None:
+        return None
+    _tiles[(kind, tile)] = compiled
+    return compiled
+
+# Write tiles to the cache with one append to the snapshot of their kind
+# tiles maps a tile to its list of elements
+def save_tiles(kind, tiles):
+    compiled = {tile: compile_tile(elements) for tile, elements in tiles.items()}
+    snapshot.append_tiles(SNAPSHOT_DIR, kind, compiled, QUERY_FILTERS[kind], TILE_DEG)
+    _tiles.update({(kind, tile): tile_compiled for tile, tile_compiled in compiled.items()})
+
+# Split elements into the tiles of a rectangle and save every tile, including empty ones
+# With only set just those tiles of the rectangle are saved, so tiles that are already
+# cached are not appended to the snapshot again.
+def store_rectangle(kind, elements, south, west, north, east, only=None):
+    tiles = {(i, j): [] for i in range(south, north + 1) for j in range(west, east + 1)
+             if only is None or (i, j) in only}
+    for el in elements:
+        lat, lon = element_point(el)
+        if lat is None or lon is None:
+            continue
+        tile = tile_of(lat, lon)
+        # Ways that cross into the box but are centered outside belong to another tile
+        if tile in tiles:
+            tiles[tile].append(el)
+    save_tiles(kind, tiles)
+
+# Fetch the missing tiles of a kind with as few bbox queries as possible
+# Tiles are grouped into blocks of BLOCK_TILES x BLOCK_TILES and each block is one query
+# Returns the number of queries sent
+def fetch_tiles(kind, tiles):
+    missing = [tile for tile in tiles if load_tile(kind, tile) is None]
+    blocks = {}
+    for tile in missing:
+        blocks.setdefault((tile[0] // BLOCK_TILES, tile[1] // BLOCK_TILES), []).append(tile)
+
+    for block in blocks.values():
+        south = min(tile[0] for tile in block)
+        north = max(tile[0] for tile in block)
+        west = min(tile[1] for tile in block)
+        east = max(tile[1] for tile in block)
+        bbox = (tile_bounds((south, west))[0], tile_bounds((south, west))[1],
+                tile_bounds((north, east))[2], tile_bounds((north, east))[3])
+        print(f"Fetching {kind} tiles {south},{west} to {north},{east}...")
+        elements = overpass(bbox_query(kind, *bbox))
+        store_rectangle(kind, elements, south, west, north, east, set(block))
+    return len(blocks)
+
+# Plan for a whole batch of requests before any method runs
+# circles is a list of (lat, lon, rad), the union of their tiles is fetched once
+# so the number of queries grows with the area covered instead of the number of requests
+def prefetch_circles(circles, kinds=('poi', 'walkable')):
+    tiles = set()
+    for lat, lon, rad in circles:
+        tiles |= query_tiles(lat, lon, rad)
+    queries = 0
+    for kind in kinds:
+        queries += fetch_tiles(kind, tiles)
+    print(f"Prefetched {len(tiles)} tiles with {queries} queries.")
+    return queries
+
+# Fill the cache from a local extract instead of the API
+# The extract is an Overpass JSON file ('out center tags') covering the box south, west, north, east
+# Only tiles that are completely inside the box are cached
+def load_extract(filename, south, west, north, east):
+    with open(filename, 'r', encoding='utf-8') as file:
+        elements = json.load(file).get('elements', [])
+    first = tile_of(south, west)
+    last = tile_of(north, east)
+    tile_south = first[0] + (tile_bounds(first)[0] < south)
+    tile_west = first[1] + (tile_bounds(first)[1] < west)
+    tile_north = last[0] - (tile_bounds(last)[2] > north)
+    tile_east = last[1] - (tile_bounds(last)[3] > east)
+    for kind in QUERY_FILTERS:
+        kind_elements = [el for el in elements if kind in element_kinds(el)]
+        store_rectangle(kind, kind_elements, tile_south, tile_west, tile_north, tile_east)
+
+# Tiles fetch_elements reads for a circle of rad km
+# They reach DEDUP_KM past the circle so every duplicate of an element in it is read too
+def query_tiles(lat, lon, rad):
+    return tiles_for_circle(lat, lon, rad + max(dedup.DEDUP_KM.values()))
+
+# Join compiled tiles into one set of candidates and merge the duplicates of a kind
+# The tiles keep every element as fetched, so an osmChange file can still change or
+# delete any of them. The leader of each group of duplicates gets the merged tags, and
+# its mask and opening hours are compiled again from them.
+# Returns the joined arrays, 'leader' marks the candidates that stand for their group and
+# element(i) builds candidate i.
+def merge_duplicates(kind, compiled_tiles):
+    starts = np.cumsum([0] + [len(tile['elements']) for tile in compiled_tiles])
+    lat = np.concatenate([tile['lat'] for tile in compiled_tiles] + [np.empty(0)])
+    lon = np.concatenate([tile['lon'] for tile in compiled_tiles] + [np.empty(0)])
+    mask = np.concatenate([tile['mask'] for tile in compiled_tiles] + [np.empty(0, dtype=np.uint64)])
+    hours = np.concatenate([tile['hours'] for tile in compiled_tiles]
+                           + [np.empty((0, opening_hours.WEEK_BYTES), dtype=np.uint8)])
+    types = np.concatenate([tile['type'] for tile in compiled_tiles] + [np.empty(0, dtype=np.uint8)])
+    names = [name for tile in compiled_tiles for name in tile['name']]
+
+    def raw_element(i):
+        t = int(np.searchsorted(starts, i, side='right')) - 1
+        return compiled_tiles[t]['elements'][i - int(starts[t])]
+
+    leaders = dedup.group_candidates(kind, types, names, lat, lon)
+    groups = {}
+    for i in np.flatnonzero(leaders != np.arange(len(leaders))).tolist():
+        groups.setdefault(int(leaders[i]), []).append(i)
+
+    merged = {}
+    for leader, members in groups.items():
+        merged[leader] = dedup.merge_group([raw_element(i) for i in [leader] + members])
+    if merged:
+        order = list(merged)
+        mask[order] = tags.compile_elements([merged[i] for i in order])
+        hours[order] = opening_hours.compile_elements([merged[i] for i in order])
+
+    return {
+        'lat': lat,
+        'lon': lon,
+        'mask': mask,
+        'hours': hours,
+        'leader': leaders == np.arange(len(leaders)),
+        'element': lambda i: merged[i] if i in merged else raw_element(i),
+    }
+
+# Elements of a kind within rad km of a point that pass a policy from tags.make_policy
+# When open_at is an opening_hours slot only the elements open at that time are kept
+# Duplicates of the same place are merged before any of that (see merge_duplicates), with
+# spacing in km the elements that pass are thinned so no two are closer than that.
+# Tiles around the point that are not cached yet are fetched into the cache first, so
+# no request is made for an area that was seen before. The distance is measured to a
+# way's center, so long ways that only clip the circle are left out.
+def fetch_elements(kind, lat, lon, rad, policy=None, open_at=None, spacing=None):
+    if policy is None:
+        policy = tags.make_policy(kind)
+    tiles = sorted(query_tiles(lat, lon, rad))
+    fetch_tiles(kind, tiles)
+    candidates = merge_duplicates(kind, [load_tile(kind, tile) for tile in tiles])
+
+    keep = candidates['leader'] & tags.select(candidates['mask'], policy)
+    if open_at is not None:
+        keep &= opening_hours.open_mask(candidates['hours'], [open_at])[0]
+    keep &= calculate_distance(lat, lon, candidates['lat'], candidates['lon']) <= rad
+    found = [candidates['element'](i) for i in np.flatnonzero(keep).tolist()]
+    points = [(candidates['lat'][i], candidates['lon'][i]) for i in np.flatnonzero(keep).tolist()]
+    return dedup.thin_elements(found, points, spacing)
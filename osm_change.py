@@ -0,0 +1,138 @@
+import xml.etree.ElementTree as ET
+import numpy as np
+import osm_cache
+import snapshot
+import store
+
+ACTIONS = ('create', 'modify', 'delete')
+
+# Key of an element that is unique across element types
+def element_key(el_type, el_id):
+    return (el_type, int(el_id))
+
+# Read an osmChange (.osc) file
+# Returns the last action of every element as {key: (action, element)} with the element in
+# the Overpass JSON form the cache stores, and the positions of every node in the file.
+# Ways keep their node ids under 'nodes' until their center is known.
+def parse(filename):
+    changes = {}
+    positions = {}
+    action = None
+    for event, node in ET.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            if node.tag in ACTIONS:
+                action = node.tag
+            continue
+        if node.tag in ACTIONS:
+            action = None
+        elif node.tag in snapshot.ELEMENT_TYPES and action is not None:
+            el = {
+                'type': node.tag,
+                'id': int(node.get('id')),
+                'tags': {tag.get('k'): tag.get('v') for tag in node.findall('tag')},
+            }
+            if node.tag == 'node' and node.get('lat') is not None:
+                el['lat'] = float(node.get('lat'))
+                el['lon'] = float(node.get('lon'))
+                positions[el['id']] = (el['lat'], el['lon'])
+            elif node.tag == 'way':
+                el['nodes'] = [int(nd.get('ref')) for nd in node.findall('nd')]
+            changes[element_key(el['type'], el['id'])] = (action, el)
+            node.clear()
+    return changes, positions
+
+# Give a changed way the center Overpass would, the middle of the bounding box of its nodes
+# Only nodes that are in the change file have a known position. Returns False when
+# none of them do.
+def set_center(el, positions):
+    points = [positions[ref] for ref in el.pop('nodes', []) if ref in positions]
+    if not points:
+        return False
+    lats, lons = zip(*points)
+    el['center'] = {'lat': (min(lats) + max(lats)) / 2, 'lon': (min(lons) + max(lons)) / 2}
+    return True
+
+# Tile of every cached element of a kind whose key is in keys
+# Uses the id and type columns of the snapshot so no tile has to be decoded
+def locate(kind, keys):
+    cached = snapshot.load(osm_cache.SNAPSHOT_DIR, kind)
+    if cached is None or not keys:
+        return {}
+    records = cached['records']
+    type_codes = {el_type: code for code, el_type in enumerate(snapshot.ELEMENT_TYPES)}
+    wanted = np.array([el_id * 4 + type_codes[el_type] for el_type, el_id in keys], dtype=np.int64)
+
+    found = {}
+    for tile_key, (start, count, _) in cached['header']['tiles'].items():
+        tile_records = records[start:start + count]
+        codes = tile_records['id'].astype(np.int64) * 4 + tile_records['type']
+        for i in np.flatnonzero(np.isin(codes, wanted)).tolist():
+            key = element_key(snapshot.ELEMENT_TYPES[tile_records['type'][i]], tile_records['id'][i])
+            found[key] = tuple(map(int, tile_key.split(',')))
+    return found
+
+# Apply the changes of parse to the cached tiles of every kind
+# Only tiles that hold a changed element, before or after the change, are written again.
+# Elements that land in a tile that is not cached are skipped, that tile is fetched
+# fresh when it is needed. A node that moves does not move the ways that use it unless
+# the ways are in the file too, because the cache only keeps way centers.
+# Returns the set of (kind, tile) that changed.
+def apply_changes(changes, positions):
+    changed = set()
+    for kind in osm_cache.QUERY_FILTERS:
+        located = locate(kind, list(changes))
+        tiles = {}
+
+        def tile_elements(tile):
+            if tile not in tiles:
+                tiles[tile] = list(osm_cache.load_tile(kind, tile)['elements'])
+            return tiles[tile]
+
+        for key, (action, el) in changes.items():
+            old = None
+            if key in located:
+                elements = tile_elements(located[key])
+                index = next(i for i, cached in enumerate(elements) if element_key(cached['type'], cached['id']) == key)
+                old = elements.pop(index)
+            if action == 'delete' or kind not in osm_cache.element_kinds(el):
+                continue
+
+            el = dict(el)
+            # Ways whose nodes are not in the file stay where the cache had them
+            if el['type'] != 'node' and not set_center(el, positions):
+                if old is None:
+                    continue
+                el['center'] = old['center']
+            lat, lon = osm_cache.element_point(el)
+            if lat is None or lon is None:
+                continue
+            tile = osm_cache.tile_of(lat, lon)
+            if tile in tiles or osm_cache.load_tile(kind, tile) is not None:
+                tile_elements(tile).append(el)
+
+        if tiles:
+            osm_cache.save_tiles(kind, tiles)
+            changed |= {(kind, tile) for tile in tiles}
+    return changed
+
+# Apply an osmChange file to the cache and invalidate the stored results it affects
+# Returns the changed (kind, tile) pairs and the number of results invalidated
+def apply_file(filename, store_file=store.STORE_FILE):
+    changes, positions = parse(filename)
+    changed = apply_changes(changes, positions)
+    conn = store.open_store(store_file)
+    invalidated = store.invalidate(conn, [osm_cache.tile_bounds(tile) for tile in {tile for _, tile in changed}])
+    conn.close()
+    return changed, invalidated
+
+def main():
+    filename = input("Enter osmChange (.osc) file: ").strip()
+    try:
+        changed, invalidated = apply_file(filename)
+    except (OSError, ET.ParseError) as e:
+        print(f"Could not read {filename}: {e}")
+        return
+    print(f"Updated {len(changed)} cached tiles and invalidated {invalidated} stored results.")
+
+if __name__ == "__main__":
+    main()
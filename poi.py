@@ -3,16 +3,18 @@ from geopy.geocoders import Nominatim
 from folium import Circle
 import webbrowser
 import os
-import requests
 import re
-import random
 from collections import defaultdict
 import warnings
 import numpy as np
-import matplotlib.pyplot as plt
+import adversary
+import adaptive
+import osm_cache
+import opening_hours
+import render
+import counts
+import streams
 
-# Using the Overpass API for mapping
-OVERPASS_URL = "http://overpass-api.de/api/interpreter"
 os.environ["OMP_NUM_THREADS"] = "1"
 warnings.filterwarnings(
     "ignore",
@@ -30,32 +32,10 @@ def GetCoordinates(address):
         return None
 
 # Using coordinates, find POIs using a query
-def FindPOIs(lat, lon, rad):
-
-    # Query for amenity, tourism, leisure, and shop tags
-    query = f"""
-    [out:json];
-    (
-      node["amenity"](around:{rad * 1000},{lat},{lon});
-      node["tourism"](around:{rad * 1000},{lat},{lon});
-      node["leisure"](around:{rad * 1000},{lat},{lon});
-      node["shop"](around:{rad * 1000},{lat},{lon});
-
-      way["amenity"](around:{rad * 1000},{lat},{lon});
-      way["tourism"](around:{rad * 1000},{lat},{lon});
-      way["leisure"](around:{rad * 1000},{lat},{lon});
-      way["shop"](around:{rad * 1000},{lat},{lon});
-
-      relation["amenity"](around:{rad * 1000},{lat},{lon});
-      relation["tourism"](around:{rad * 1000},{lat},{lon});
-      relation["leisure"](around:{rad * 1000},{lat},{lon});
-      relation["shop"](around:{rad * 1000},{lat},{lon});
-    );
-    out center tags;
-    """
-
-    response = requests.get(OVERPASS_URL, params={'data': query})
-    data = response.json()
+def FindPOIs(lat, lon, rad, policy=None, open_at=None, spacing=None):
+
+    # Query for amenity, tourism, leisure, and shop tags, served from the tile cache when it covers the radius
+    data = {'elements': osm_cache.fetch_elements('poi', lat, lon, rad, policy, open_at, spacing)}
     pois = []
 
     # Parse the JSON file to put POIs in a list
@@ -96,7 +76,7 @@ def ParsePOI(poi):
         return "Unknown", "0", "0"
 
 # Create the html map of the chosen location and the found POIs
-def CreateMap(lat, lon, rad, pois, poi_counter, noise):
+def CreateMap(lat, lon, rad, pois, poi_counter, noise, adversary_error=None, runs_used=None, rng=None, sample_size=None):
     Map = folium.Map(location=[lat, lon], zoom_start=13)
     folium.Marker([lat, lon], popup="Selected Location").add_to(Map)
 
@@ -111,16 +91,23 @@ def CreateMap(lat, lon, rad, pois, poi_counter, noise):
 
     offset_points = []
 
+    # With sample_size noisy points are only made for a sample of that many suggestions so
+    # the map and text file stay small for counts-only runs, otherwise every suggestion gets one
+    if rng is None:
+        rng = np.random.default_rng()
+    poi_counts = np.array([poi_counter.get(poi, 0) for poi in pois], dtype=np.int64)
+    sampled = poi_counts if sample_size is None else counts.sample(poi_counts, sample_size, rng=rng)
+
     # Take all the found POIs and apply noise to them to generate the point
-    for poi in pois:
+    for poi, sample_count in zip(pois, sampled.tolist()):
         name, latStr, lonStr = ParsePOI(poi)
         latF = float(latStr)
         lonF = float(lonStr)
 
         #NOISE = 0.002
-        for x in range(poi_counter[poi]):
-            offset_lat = latF + random.uniform(-noise, noise)
-            offset_lon = lonF + random.uniform(-noise, noise)
+        for x in range(sample_count):
+            offset_lat = latF + rng.uniform(-noise, noise)
+            offset_lon = lonF + rng.uniform(-noise, noise)
             folium.CircleMarker(
                 location=[offset_lat, offset_lon],
                 radius=2,
@@ -136,8 +123,14 @@ def CreateMap(lat, lon, rad, pois, poi_counter, noise):
     # Write to a text file all the found POIs
     with open("POIs.txt", "w", encoding="utf-8") as file:
         file.write("Random POI's with noise: (lat, lon): \n")
+        if len(offset_points) < poi_counts.sum():
+            file.write(f"Sample of {len(offset_points)} out of {poi_counts.sum()} suggestions\n")
         for offset_lat, offset_lon in offset_points:
             file.write(f"({offset_lat}, {offset_lon})\n")
+        if adversary_error is not None:
+            file.write(f"Adversary error: {adversary_error}\n")
+        if runs_used is not None:
+            file.write(f"Runs used: {runs_used}\n")
 
     # Write to a text file all the POIs that were selected and how many times they were
     with open("Chosen_POIs.txt", "w", encoding="utf-8") as file:
@@ -145,7 +138,7 @@ def CreateMap(lat, lon, rad, pois, poi_counter, noise):
         for poi, count in sorted_pois:
             if count > 0:
                 name, lat_str, lon_str = ParsePOI(poi)
-                file.write(f"{name} ({lat_str}, {lon_str})\n")
+                file.write(f"{name} ({lat_str}, {lon_str}): {count}\n")
 
 # Harversine formula for finding the distance between two coordinates
 # https://www.geeksforgeeks.org/haversine-formula-to-find-distance-between-two-points-on-a-sphere/
@@ -174,6 +167,7 @@ def Main():
         if not coords:
             print("Address not found")
             return
+        location = address
     elif ch == 'coordinates':
         try:
             lat = float(input("Latitude: "))
@@ -182,6 +176,7 @@ def Main():
         except ValueError:
             print("Invalid Coordinates")
             return
+        location = f"{lat},{lon}"
     else:
         print("Invalid Entry")
         return
@@ -199,16 +194,41 @@ def Main():
     except ValueError:
         print("Invalid Noise Value")
         return
+
+    # From the user get the time the POIs have to be open at, blank means any time
+    open_at = None
+    try:
+        time_input = input("Enter time the POIs must be open ('now', a day and time like 'Tu 14:30', or blank for any time): ")
+        if time_input.strip():
+            open_at = opening_hours.parse_slot(time_input)
+    except ValueError as e:
+        print(e)
+        return
     
-    # From the user get the number of runs
+    # From the user get the number of runs, 'auto' keeps running until the estimates are precise enough
+    precision = None
     try:
-        num_runs = int(input("Enter number of runs: "))
+        runs_input = input("Enter number of runs (or 'auto'): ").strip().lower()
+        if runs_input == 'auto':
+            precision = float(input(f"Enter target precision (KM) ({adaptive.DEFAULT_PRECISION} is a recommended value): "))
+        else:
+            num_runs = int(runs_input)
     except ValueError:
         print("Invalid number of runs")
         return
 
+    # From the user get the seed, the same seed, location and inputs always give the same suggestions
+    try:
+        seed = streams.parse_seed(input("Enter seed (blank for random): "))
+    except ValueError:
+        print("Invalid Seed")
+        return
+    print(f"Seed: {seed}")
+    rng = streams.stream(seed, location, "POI")
+    noise_rng = streams.stream(seed, location, "POI noise")
+
     # Find all POIs within the given radius
-    pois = FindPOIs(coords[0], coords[1], radius)
+    pois = FindPOIs(coords[0], coords[1], radius, open_at=open_at)
     if not pois:
         print("No POIs found.")
         return
@@ -216,57 +236,116 @@ def Main():
     poi_counter = defaultdict(int)
     utility_values = []
     privacy_values = []
+    adversary_values = []
+
+    # Precompute the Bayesian adversary over a grid around the user
+    # It also needs the POIs the cells away from the user can reach, which go past the radius
+    poi_coords = [(float(ParsePOI(poi)[1]), float(ParsePOI(poi)[2])) for poi in pois]
+    poi_index = {poi: i for i, poi in enumerate(pois)}
+    area_pois = FindPOIs(coords[0], coords[1], adversary.area_radius(radius), open_at=open_at)
+    area_coords = [(float(ParsePOI(poi)[1]), float(ParsePOI(poi)[2])) for poi in area_pois]
+    adversary_model = adversary.build_model(coords[0], coords[1], radius, poi_coords, area=area_coords)
+    adversary_counts = np.zeros(len(pois))
+
+    # Adaptive mode draws runs in blocks and stops once the privacy and utility are within the precision
+    if precision is not None:
+        result = adaptive.estimate(coords[0], coords[1], poi_coords, precision, rng=rng)
+        for i, count in enumerate(result['counts'].tolist()):
+            if count > 0:
+                poi_counter[pois[i]] = count
+        adversary_error = adversary.expected_error(adversary_model, result['counts'])
+
+        print(f"Used {result['runs']} runs")
+        print(f"Privacy = {result['privacy']} +/- {result['privacy_ci']}")
+        print(f"Utility = {result['utility']} +/- {result['utility_ci']}")
+        print(f"Adversary Error = {adversary_error}")
+
+        # The map and text files are written in the background
+        sample_size = counts.SAMPLE_POINTS if result['runs'] > counts.COUNTS_ONLY_RUNS else None
+        render.submit(CreateMap, coords[0], coords[1], radius, pois, poi_counter, noise, adversary_error, result['runs'], rng=noise_rng,
+                      sample_size=sample_size, callback=render.announce("POI_Map.html", "POIs.txt", "Chosen_POIs.txt"))
+        return
 
-    # For each iteration, calculate the privacy and utility values and save them
-    for x in range(num_runs):
-        chosen = random.choice(pois)
-        poi_counter[chosen] += 1
-
-        utility = 0.0
-        privacy = 0.0
-
-        # Utility is average distance from all current POIs in the iteration to the chosen location
-        for poi, count in poi_counter.items():
-            name, latStr, lonStr = ParsePOI(poi)
-            latF = float(latStr)
-            lonF = float(lonStr)
-            dist = CalculateDistance(coords[0], coords[1], latF, lonF)
-            utility += dist / len(poi_counter)
+    # Long runs only keep how many times each POI was chosen and record the metrics at
+    # checkpoints, so memory does not grow with the number of runs
+    if num_runs > counts.COUNTS_ONLY_RUNS:
+        poi_lat = np.array([c[0] for c in poi_coords])
+        poi_lon = np.array([c[1] for c in poi_coords])
+        poi_distances = CalculateDistance(coords[0], coords[1], poi_lat, poi_lon)
+        run_points = []
+        for run, run_counts in counts.draw(num_runs, len(pois), seed, location, "POI"):
+            # Same metrics as the run by run loop, over every POI chosen at least once
+            chosen = run_counts > 0
+            utility = poi_distances[chosen].mean()
+            privacy = CalculateDistance(coords[0], coords[1], poi_lat[chosen].mean(), poi_lon[chosen].mean())
+            adversary_error = adversary.expected_error(adversary_model, run_counts)
+
+            run_points.append(run)
+            utility_values.append(utility)
+            privacy_values.append(privacy)
+            adversary_values.append(adversary_error)
+
+            print(f"Iteration {run}")
+            print(f"Privacy = {privacy}")
+            print(f"Utility = {utility}")
+            print(f"Adversary Error = {adversary_error}")
+            print("")
+
+        for i, count in enumerate(run_counts.tolist()):
+            if count > 0:
+                poi_counter[pois[i]] = count
+    else:
+        run_points = range(1, num_runs + 1)
+
+        # For each iteration, calculate the privacy and utility values and save them
+        for x in range(num_runs):
+            chosen = pois[rng.integers(len(pois))]
+            poi_counter[chosen] += 1
+            adversary_counts[poi_index[chosen]] += 1
+
+            utility = 0.0
+            privacy = 0.0
+
+            # Utility is average distance from all current POIs in the iteration to the chosen location
+            for poi, count in poi_counter.items():
+                name, latStr, lonStr = ParsePOI(poi)
+                latF = float(latStr)
+                lonF = float(lonStr)
+                dist = CalculateDistance(coords[0], coords[1], latF, lonF)
+                utility += dist / len(poi_counter)
         
-        # Privacy is the distance from the centroid of all current POIs in the iteration to the chosen location
-        centroid_lat = sum(float(ParsePOI(poi)[1]) for poi in poi_counter) / len(poi_counter)
-        centroid_lon = sum(float(ParsePOI(poi)[2]) for poi in poi_counter) / len(poi_counter)
-        privacy = CalculateDistance(coords[0], coords[1], centroid_lat, centroid_lon)
-
-        utility_values.append(utility)
-        privacy_values.append(privacy)
-
-        print(f"Iteration {x + 1}")
-        print(f"Privacy = {privacy}")
-        print(f"Utility = {utility}")
-        print("")
-
-    # Create the map
-    CreateMap(coords[0], coords[1], radius, pois, poi_counter, noise)
+            # Privacy is the distance from the centroid of all current POIs in the iteration to the chosen location
+            centroid_lat = sum(float(ParsePOI(poi)[1]) for poi in poi_counter) / len(poi_counter)
+            centroid_lon = sum(float(ParsePOI(poi)[2]) for poi in poi_counter) / len(poi_counter)
+            privacy = CalculateDistance(coords[0], coords[1], centroid_lat, centroid_lon)
+
+            # Adversary error is the expected distance between the adversary's guess and the user
+            adversary_error = adversary.expected_error(adversary_model, adversary_counts)
+
+            utility_values.append(utility)
+            privacy_values.append(privacy)
+            adversary_values.append(adversary_error)
+
+            print(f"Iteration {x + 1}")
+            print(f"Privacy = {privacy}")
+            print(f"Utility = {utility}")
+            print(f"Adversary Error = {adversary_error}")
+            print("")
+
+    # Create the map, text files and graph in the background so the results above are not held up
+    # With no runs the adversary only has the prior to guess from
+    final_adversary_error = adversary_values[-1] if adversary_values else adversary.expected_error(adversary_model, adversary_counts)
+    sample_size = counts.SAMPLE_POINTS if num_runs > counts.COUNTS_ONLY_RUNS else None
+    render.submit(CreateMap, coords[0], coords[1], radius, pois, poi_counter, noise, final_adversary_error, rng=noise_rng,
+                  sample_size=sample_size, callback=render.announce("POI_Map.html", "POIs.txt", "Chosen_POIs.txt"))
 
     # Plot the privacy and utility vs iteration
-    plt.figure(figsize=(12, 5))
-
-    plt.subplot(1, 2, 1)
-    plt.plot(range(1, num_runs + 1), utility_values, marker='o', color='green')
-    plt.title('Utility vs Iteration')
-    plt.xlabel('Iteration')
-    plt.ylabel('Utility (Avg Distance to Chosen POIs)')
-
-    plt.subplot(1, 2, 2)
-    plt.plot(range(1, num_runs + 1), privacy_values, marker='o', color='red')
-    plt.title('Privacy vs Iteration')
-    plt.xlabel('Iteration')
-    plt.ylabel('Privacy (Distance to Centroid of POIs)')
-
-    plt.tight_layout()
-    plt.savefig("POI_Utility_Privacy_Graph")
-    plt.show()
+    render.submit(render.plot_runs, "POI_Utility_Privacy_Graph", run_points, [
+        (utility_values, 'green', 'Utility vs Iteration', 'Utility (Avg Distance to Chosen POIs)'),
+        (privacy_values, 'red', 'Privacy vs Iteration', 'Privacy (Distance to Centroid of POIs)'),
+        (adversary_values, 'purple', 'Adversary Error vs Iteration', 'Adversary Error (Expected Guess Distance)'),
+    ], show=True, callback=render.announce("POI_Utility_Privacy_Graph.png"))
 
 if __name__ == "__main__":
     Main()
+    render.wait()
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+import threading
+import webbrowser
+import os
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Maps, graphs and text reports are written by one background thread
+# folium and matplotlib are not safe to run from several threads at once, and one
+# thread also keeps the files in the order they were submitted
+RENDER_WORKERS = 1
+
+_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+_pending = []
+_lock = threading.Lock()
+
+# Print the error of a job that failed, nothing else would show it
+def _report(future):
+    error = future.exception()
+    if error is not None:
+        print(f"Error writing output: {error}")
+
+# Run fn(*args, **kwargs) in the background and return its Future right away
+# callback(future) is called once the job is done
+def submit(fn, *args, callback=None, **kwargs):
+    future = _executor.submit(fn, *args, **kwargs)
+    future.add_done_callback(_report)
+    if callback is not None:
+        future.add_done_callback(callback)
+    with _lock:
+        _pending.append(future)
+    return future
+
+# Block until every submitted job is done, scripts call this before they exit
+def wait():
+    with _lock:
+        pending = list(_pending)
+        _pending.clear()
+    wait_futures(pending)
+
+# Callback that prints the files a job wrote
+def announce(*filenames):
+    def callback(future):
+        if future.exception() is None:
+            print(f"Saved {', '.join(filenames)}")
+    return callback
+
+# Open a saved file in the browser
+def open_file(filename):
+    webbrowser.open('file://' + os.path.realpath(filename))
+
+# Save a graph with one subplot per series of values over the runs
+# series is a list of (values, color, title, ylabel). The figure is built with the Agg
+# canvas directly instead of pyplot so it can be drawn outside the main thread.
+def plot_runs(filename, runs, series, xlabel='Iteration', show=False):
+    fig = Figure(figsize=(6 * len(series), 5))
+    FigureCanvasAgg(fig)
+    for i, (values, color, title, ylabel) in enumerate(series):
+        ax = fig.add_subplot(1, len(series), i + 1)
+        ax.plot(runs, values, marker='o', color=color)
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+    fig.tight_layout()
+    fig.savefig(filename)
+    if show:
+        open_file(filename if os.path.splitext(filename)[1] else filename + ".png")
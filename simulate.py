@@ -0,0 +1,246 @@
+import os
+import time
+from multiprocessing import Pool
+import numpy as np
+from hybrid import GetCoordinates, FindPOIs, FindWalkableAreas
+import osm_cache
+import spatial
+import geoind
+import streams
+
+# Number of users handled by one worker task
+SHARD_USERS = 500
+
+# An anchor counts as found when a recovered cluster center is this close to it, in km
+RECOVERY_KM = 0.2
+
+# Number of k-means iterations of the attack
+KMEANS_ITERATIONS = 10
+
+# Candidate density in locations per square km when no map data is used
+SYNTHETIC_DENSITY = 400
+
+# State shared by the worker processes, set once by init_worker
+_shared = {}
+
+def init_worker(shared):
+    _shared.update(shared)
+
+# Random points spread uniformly over a disk of rad km around (lat, lon)
+def random_points(lat, lon, rad, size, rng):
+    r = rad * np.sqrt(rng.uniform(0, 1, size))
+    theta = rng.uniform(0, 2 * np.pi, size)
+    return spatial.unproject(r * np.cos(theta), r * np.sin(theta), lat, lon)
+
+# Users with a home and a work anchor anywhere in the city
+# Returns (users, 2) arrays of anchor latitudes and longitudes, column 0 is home and 1 is work
+def make_users(lat, lon, city_radius, num_users, rng):
+    anchor_lat, anchor_lon = random_points(lat, lon, city_radius, 2 * num_users, rng)
+    return anchor_lat.reshape(num_users, 2), anchor_lon.reshape(num_users, 2)
+
+# Suggestions for every request of a shard of users
+# Each simulated day a user asks once from home and once from work. The candidates near
+# every anchor are looked up once and reused for all of that anchor's requests.
+# Returns (users, 2 * days) arrays of suggestion x and y in km, NaN where no candidate was found.
+def suggest_shard(anchor_lat, anchor_lon, days, rng):
+    index = _shared['index']
+    num_users = anchor_lat.shape[0]
+    requests = np.tile([0, 1], days)
+
+    if _shared['method'] == 'geoind':
+        # Every request perturbs the anchor and snaps to the nearest candidate
+        lat = anchor_lat[:, requests].ravel()
+        lon = anchor_lon[:, requests].ravel()
+        noisy_lat, noisy_lon = geoind.planar_laplace(lat, lon, _shared['epsilon'], len(lat), rng)
+        positions, _ = spatial.nearest_batch(index, noisy_lat, noisy_lon)
+        positions = positions.reshape(num_users, 2 * days)
+    else:
+        # Uniform choice among the candidates within the walking radius of the anchor
+        offsets, near = spatial.within_batch(index, anchor_lat.ravel(), anchor_lon.ravel(), _shared['radius'])
+        counts = np.diff(offsets).reshape(num_users, 2)[:, requests]
+        picks = offsets[:-1].reshape(num_users, 2)[:, requests]
+        picks += np.floor(rng.uniform(0, 1, counts.shape) * counts).astype(np.int64)
+        positions = np.full(counts.shape, -1, dtype=np.int64)
+        has = counts > 0
+        positions[has] = near[picks[has]]
+
+    slots = np.argsort(index['order'])
+    x = np.where(positions >= 0, index['x'][slots[np.maximum(positions, 0)]], np.nan)
+    y = np.where(positions >= 0, index['y'][slots[np.maximum(positions, 0)]], np.nan)
+    return x, y
+
+# Re-identification attack on every user of a shard at once
+# The attacker runs 2-means on each user's suggestions and treats the two centers
+# as guesses for home and work. Returns the (users, 2) center coordinates and the
+# number of suggestions each user got.
+def attack(x, y):
+    valid = ~np.isnan(x)
+    px = np.where(valid, x, 0.0)
+    py = np.where(valid, y, 0.0)
+    n = valid.sum(axis=1)
+    users = np.arange(x.shape[0])
+
+    # Start from the first suggestion and the suggestion farthest from it
+    first = valid.argmax(axis=1)
+    cx0, cy0 = px[users, first], py[users, first]
+    far = np.where(valid, np.hypot(px - cx0[:, None], py - cy0[:, None]), -1).argmax(axis=1)
+    centers_x = np.stack((cx0, px[users, far]), axis=1)
+    centers_y = np.stack((cy0, py[users, far]), axis=1)
+
+    for _ in range(KMEANS_ITERATIONS):
+        d0 = np.hypot(px - centers_x[:, :1], py - centers_y[:, :1])
+        d1 = np.hypot(px - centers_x[:, 1:], py - centers_y[:, 1:])
+        second = (d1 < d0) & valid
+        first_cluster = ~second & valid
+        for c, members in enumerate((first_cluster, second)):
+            size = members.sum(axis=1)
+            has = size > 0
+            centers_x[has, c] = (px * members).sum(axis=1)[has] / size[has]
+            centers_y[has, c] = (py * members).sum(axis=1)[has] / size[has]
+
+    return centers_x, centers_y, n
+
+# Simulate one shard of users
+# Returns (users, 2) distances from each anchor to the closest recovered center,
+# NaN for users without suggestions
+def run_shard(task):
+    start, anchor_lat, anchor_lon, shard = task
+    rng = streams.stream(_shared['seed'], _shared['location'], _shared['method'], shard)
+    x, y = suggest_shard(anchor_lat, anchor_lon, _shared['days'], rng)
+    centers_x, centers_y, n = attack(x, y)
+
+    ax, ay = spatial.project(anchor_lat, anchor_lon, *_shared['index']['ref'])
+    errors = np.full(anchor_lat.shape, np.nan)
+    for anchor in range(2):
+        dist = np.hypot(centers_x - ax[:, anchor:anchor + 1], centers_y - ay[:, anchor:anchor + 1])
+        errors[:, anchor] = np.where(n > 0, dist.min(axis=1), np.nan)
+    return start, errors
+
+# Run the whole population, shards are spread over all cores
+def simulate(lat, lon, city_radius, candidates, radius, num_users, days, method='uniform',
+             epsilon=geoind.DEFAULT_EPSILON, seed=None, processes=None):
+    # Every shard has its own stream so the results do not depend on the number of processes
+    if seed is None:
+        seed = streams.new_seed()
+    location = f"{lat},{lon}"
+    anchor_lat, anchor_lon = make_users(lat, lon, city_radius, num_users, streams.stream(seed, location, "users"))
+
+    # Radius searches are fastest with cells the size of the radius, nearest searches with small cells
+    cell_km = spatial.CELL_KM if method == 'geoind' else max(radius, spatial.CELL_KM)
+    shared = {
+        'index': spatial.build_index(candidates, cell_km=cell_km, ref=(lat, lon)),
+        'radius': radius,
+        'days': days,
+        'method': method,
+        'epsilon': epsilon,
+        'seed': seed,
+        'location': location,
+    }
+    tasks = [
+        (start, anchor_lat[start:start + SHARD_USERS], anchor_lon[start:start + SHARD_USERS], i)
+        for i, start in enumerate(range(0, num_users, SHARD_USERS))
+    ]
+
+    errors = np.full((num_users, 2), np.nan)
+    with Pool(processes, initializer=init_worker, initargs=(shared,)) as pool:
+        for start, shard_errors in pool.imap_unordered(run_shard, tasks):
+            errors[start:start + len(shard_errors)] = shard_errors
+    return errors
+
+# Candidate locations for the whole city, from the map or spread uniformly
+def city_candidates(lat, lon, city_radius, radius, source, rng):
+    if source == 'synthetic':
+        area = np.pi * (city_radius + radius) ** 2
+        cand_lat, cand_lon = random_points(lat, lon, city_radius + radius, int(area * SYNTHETIC_DENSITY), rng)
+        return np.stack((cand_lat, cand_lon), axis=1)
+
+    # Fetch the city once through the tile cache, every user reuses it
+    osm_cache.prefetch_circles([(lat, lon, city_radius + radius)])
+    locations = FindPOIs(lat, lon, city_radius + radius) + FindWalkableAreas(lat, lon, city_radius + radius)
+    return np.array([(float(loc[1]), float(loc[2])) for loc in locations], dtype=float).reshape(-1, 2)
+
+def Main():
+    # From the user get the center of the city
+    ch = input("Type 'Address' or 'Coordinates' for the city center: ").strip().lower()
+    if ch == 'address':
+        coords = GetCoordinates(input("Enter address: "))
+        if not coords:
+            print("Address not found")
+            return
+    elif ch == 'coordinates':
+        try:
+            coords = (float(input("Latitude: ")), float(input("Longitude: ")))
+        except ValueError:
+            print("Invalid Coordinates")
+            return
+    else:
+        print("Invalid Entry")
+        return
+
+    # From the user get the size of the simulation
+    try:
+        city_radius = float(input("City radius (KM) that homes and workplaces are spread over: "))
+        radius = float(input("Walking radius (KM): "))
+        num_users = int(input("Number of users: "))
+        days = int(input("Number of days: "))
+    except ValueError:
+        print("Invalid number")
+        return
+
+    method = input("Type 'Uniform' (POI/walkable style) or 'GeoInd' for the obfuscation method: ").strip().lower()
+    if method not in ('uniform', 'geoind'):
+        print("Invalid Entry")
+        return
+    epsilon = geoind.DEFAULT_EPSILON
+    if method == 'geoind':
+        try:
+            epsilon = float(input(f"Enter epsilon (1/KM) ({geoind.DEFAULT_EPSILON} is a recommended value): "))
+        except ValueError:
+            print("Invalid Epsilon")
+            return
+
+    source = input("Type 'OSM' or 'Synthetic' for the candidate locations: ").strip().lower()
+    if source not in ('osm', 'synthetic'):
+        print("Invalid Entry")
+        return
+
+    try:
+        seed = streams.parse_seed(input("Enter seed (blank for random): "))
+    except ValueError:
+        print("Invalid Seed")
+        return
+    print(f"Seed: {seed}")
+
+    candidates = city_candidates(coords[0], coords[1], city_radius, radius, source,
+                                 streams.stream(seed, f"{coords[0]},{coords[1]}", "candidates"))
+    if not len(candidates):
+        print("No locations found in the city.")
+        return
+    print(f"Simulating {num_users} users for {days} days over {len(candidates)} candidate locations "
+          f"on {os.cpu_count()} cores...")
+
+    started = time.time()
+    errors = simulate(coords[0], coords[1], city_radius, candidates, radius, num_users, days, method, epsilon, seed)
+    elapsed = time.time() - started
+
+    served = ~np.isnan(errors[:, 0])
+    found = errors <= RECOVERY_KM
+    lines = [
+        f"Users: {num_users} ({served.sum()} with candidates near home)",
+        f"Days: {days}",
+        f"Method: {method}",
+        f"Home recovered within {RECOVERY_KM} km: {found[:, 0].mean():.2%}",
+        f"Work recovered within {RECOVERY_KM} km: {found[:, 1].mean():.2%}",
+        f"Both recovered: {found.all(axis=1).mean():.2%}",
+        f"Median home error: {np.nanmedian(errors[:, 0]):.4f} km",
+        f"Median work error: {np.nanmedian(errors[:, 1]):.4f} km",
+        f"Time: {elapsed:.1f} s",
+    ]
+    print("\n".join(lines))
+
+    # Write the summary to a text file
+    with open("Simulation_Results.txt", "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,268 @@
+import json
+import os
+import time
+import numpy as np
+import tags
+import opening_hours
+
+# Version of the snapshot format, snapshots written by another version are ignored
+SNAPSHOT_VERSION = 1
+
+# Element types, stored as their position in this list
+ELEMENT_TYPES = ['node', 'way', 'relation']
+
+# One fixed width record per candidate
+# name and the other tags (as JSON) are byte ranges into the string table
+RECORD_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('type', 'u1'),
+    ('lat', '<f8'),
+    ('lon', '<f8'),
+    ('name_offset', '<u8'),
+    ('name_length', '<u4'),
+    ('tags_offset', '<u8'),
+    ('tags_length', '<u4'),
+    ('mask', '<u8'),
+    ('hours', 'u1', (opening_hours.WEEK_BYTES,)),
+])
+
+# Snapshots loaded in this process, keyed by (directory, kind)
+_loaded = {}
+
+def header_path(directory, kind):
+    return os.path.join(directory, f"{kind}.header.json")
+
+# Paths of the record and string files of a generation
+# Rewriting a snapshot starts a new generation so processes that still map the old
+# files keep reading them
+def data_paths(directory, kind, generation):
+    return (
+        os.path.join(directory, f"{kind}.records.{generation}.bin"),
+        os.path.join(directory, f"{kind}.strings.{generation}.bin"),
+    )
+
+# Remove the record and string files of every generation of a kind but the given one
+# Files that are still mapped, by this or another process, cannot be removed on every
+# system, those are left for the next call
+def remove_old_generations(directory, kind, generation):
+    current = set(data_paths(directory, kind, generation))
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(f"{kind}.") and name.endswith(".bin") and path not in current:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def tile_key(tile):
+    return f"{tile[0]},{tile[1]}"
+
+def read_header(directory, kind):
+    path = header_path(directory, kind)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        header = json.load(file)
+    if header.get('version') != SNAPSHOT_VERSION:
+        return None
+    return header
+
+# Elements of a snapshot slice, built only when they are read
+# Callers index a few elements out of a tile, so the tags are not decoded for the rest
+class Elements:
+    def __init__(self, records, strings):
+        self.records = records
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def text(self, offset, length):
+        return bytes(self.strings[offset:offset + length]).decode('utf-8')
+
+    def __getitem__(self, i):
+        record = self.records[i]
+        el_tags = json.loads(self.text(int(record['tags_offset']), int(record['tags_length'])))
+        if record['name_length']:
+            el_tags['name'] = self.text(int(record['name_offset']), int(record['name_length']))
+        el_type = ELEMENT_TYPES[record['type']]
+        el = {'type': el_type, 'id': int(record['id']), 'tags': el_tags}
+        point = {'lat': float(record['lat']), 'lon': float(record['lon'])}
+        # Overpass gives nodes a position and ways and relations a center
+        if el_type == 'node':
+            el.update(point)
+        else:
+            el['center'] = point
+        return el
+
+# Map the snapshot of a kind into memory
+# The records are one np.memmap over the whole file, tiles are slices of it.
+# Returns None when there is no snapshot.
+def load(directory, kind):
+    if (directory, kind) in _loaded:
+        return _loaded[(directory, kind)]
+    header = read_header(directory, kind)
+    if header is None:
+        return None
+    records_path, strings_path = data_paths(directory, kind, header['generation'])
+    remove_old_generations(directory, kind, header['generation'])
+
+    # Only the records and strings the header counts are read, bytes past them are an
+    # append that did not finish
+    count = header['records']
+    if count:
+        records = np.memmap(records_path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+    else:
+        records = np.empty(0, dtype=RECORD_DTYPE)
+    if header['strings']:
+        strings = np.memmap(strings_path, dtype=np.uint8, mode='r', shape=(header['strings'],))
+    else:
+        strings = np.empty(0, dtype=np.uint8)
+
+    # Masks are compiled again when tags.TAG_BITS changed since the snapshot was written
+    masks = None
+    if header['tag_bits'] != tags.TAG_BITS:
+        masks = tags.compile_elements(Elements(records, strings))
+
+    _loaded[(directory, kind)] = {'header': header, 'records': records, 'strings': strings, 'masks': masks}
+    return _loaded[(directory, kind)]
+
+# Compiled candidates of a tile in the snapshot, in the form osm_cache.compile_tile returns
+# Returns None when the tile is not in the snapshot
+def load_tile(directory, kind, tile):
+    snapshot = load(directory, kind)
+    if snapshot is None or tile_key(tile) not in snapshot['header']['tiles']:
+        return None
+    start, count, _ = snapshot['header']['tiles'][tile_key(tile)]
+    records = snapshot['records'][start:start + count]
+    masks = snapshot['masks']
+    elements = Elements(records, snapshot['strings'])
+    return {
+        'elements': elements,
+        'type': records['type'],
+        'name': [elements.text(int(offset), int(length)) if length else None
+                 for offset, length in zip(records['name_offset'].tolist(), records['name_length'].tolist())],
+        'lat': records['lat'],
+        'lon': records['lon'],
+        'mask': records['mask'] if masks is None else masks[start:start + count],
+        'hours': records['hours'],
+    }
+
+# Records and string table bytes of compiled tiles
+# strings_start is the size of the string table the new strings are added to
+def encode_tiles(compiled_tiles, strings_start):
+    total = sum(len(compiled['elements']) for compiled in compiled_tiles)
+    records = np.zeros(total, dtype=RECORD_DTYPE)
+    strings = bytearray()
+    i = 0
+    for compiled in compiled_tiles:
+        n = len(compiled['elements'])
+        records['lat'][i:i + n] = compiled['lat']
+        records['lon'][i:i + n] = compiled['lon']
+        records['mask'][i:i + n] = compiled['mask']
+        records['hours'][i:i + n] = compiled['hours']
+        for el in compiled['elements']:
+            el_tags = dict(el.get('tags', {}))
+            name = el_tags.pop('name', '').encode('utf-8')
+            rest = json.dumps(el_tags, separators=(',', ':')).encode('utf-8')
+            records[i]['id'] = el.get('id', 0)
+            records[i]['type'] = ELEMENT_TYPES.index(el.get('type', 'node'))
+            records[i]['name_offset'] = strings_start + len(strings)
+            records[i]['name_length'] = len(name)
+            strings += name
+            records[i]['tags_offset'] = strings_start + len(strings)
+            records[i]['tags_length'] = len(rest)
+            strings += rest
+            i += 1
+    return records, bytes(strings)
+
+# Append compiled tiles to the snapshot of a kind
+# tiles maps a tile to the result of osm_cache.compile_tile. The records and strings are
+# added to the end of their files first and the header is replaced last in one step, so a
+# reader sees either the old snapshot or the new one. A tile that is already in the
+# snapshot points to its new records and the old ones are left unused until compact.
+# Only one process should write to a snapshot at a time.
+def append_tiles(directory, kind, tiles, query, tile_deg):
+    header = read_header(directory, kind)
+    if header is not None and header['tag_bits'] != tags.TAG_BITS:
+        # The stored masks are out of date, every tile is written again with new ones
+        return compact(directory, kind, tiles, query, tile_deg)
+    if header is None:
+        header = new_header(kind, 0)
+    return write_tiles(directory, header, tiles, query, tile_deg)
+
+# Write the snapshot of a kind again in a new generation, leaving out unused records
+# tiles are added or replace the tiles that are already there
+def compact(directory, kind, tiles=None, query=None, tile_deg=None):
+    header = read_header(directory, kind)
+    if header is None:
+        return None if not tiles else append_tiles(directory, kind, tiles, query, tile_deg)
+    tiles = tiles or {}
+    kept = {}
+    for key in header['tiles']:
+        tile = tuple(map(int, key.split(',')))
+        if tile not in tiles:
+            kept[tile] = load_tile(directory, kind, tile)
+    header = write_tiles(directory, new_header(kind, header['generation'] + 1, header['created']), {**kept, **tiles},
+                         query or header['query'], tile_deg or header['tile_deg'])
+
+    # The kept tiles map the old files, they are removed once nothing maps them
+    del kept
+    remove_old_generations(directory, kind, header['generation'])
+    return header
+
+def new_header(kind, generation, created=None):
+    return {
+        'version': SNAPSHOT_VERSION,
+        'kind': kind,
+        'generation': generation,
+        'created': created or time.time(),
+        'records': 0,
+        'strings': 0,
+        'tiles': {},
+    }
+
+# Add tiles to the end of the files of the header's generation and replace the header
+def write_tiles(directory, header, tiles, query, tile_deg):
+    os.makedirs(directory, exist_ok=True)
+    now = time.time()
+    header['query'] = query
+    header['tile_deg'] = tile_deg
+    header['tag_bits'] = tags.TAG_BITS
+
+    order = list(tiles)
+    records, strings = encode_tiles([tiles[tile] for tile in order], header['strings'])
+
+    # Anything past the sizes in the header is left over from an append that did not finish
+    records_path, strings_path = data_paths(directory, header['kind'], header['generation'])
+    for path, size, data in ((records_path, header['records'] * RECORD_DTYPE.itemsize, records.tobytes()),
+                             (strings_path, header['strings'], strings)):
+        with open(path, 'ab') as file:
+            file.truncate(size)
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+    start = header['records']
+    for tile in order:
+        count = len(tiles[tile]['elements'])
+        header['tiles'][tile_key(tile)] = [start, count, now]
+        start += count
+    header['records'] = start
+    header['strings'] += len(strings)
+    header['updated'] = now
+
+    # Region covered by the snapshot as the south, west, north and east edges in degrees
+    cached = [tuple(map(int, key.split(','))) for key in header['tiles']] or [(0, 0)]
+    header['region'] = [min(t[0] for t in cached) * tile_deg, min(t[1] for t in cached) * tile_deg,
+                        (max(t[0] for t in cached) + 1) * tile_deg, (max(t[1] for t in cached) + 1) * tile_deg]
+
+    path = header_path(directory, header['kind'])
+    with open(path + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(header, file)
+    os.replace(path + ".tmp", path)
+    _loaded.pop((directory, header['kind']), None)
+    return header
@@ -0,0 +1,194 @@
+import heapq
+import numpy as np
+
+# Radius of the earth in km, same value the haversine functions use
+EARTH_RADIUS = 6371.0
+
+# Default side length of a grid cell in km
+CELL_KM = 0.1
+
+# Project coordinates onto a flat plane in km around a reference point
+# This is an equirectangular projection which is accurate at the city scale used here
+def project(lat, lon, ref_lat, ref_lon):
+    x = np.radians(np.asarray(lon, dtype=float) - ref_lon) * EARTH_RADIUS * np.cos(np.radians(ref_lat))
+    y = np.radians(np.asarray(lat, dtype=float) - ref_lat) * EARTH_RADIUS
+    return x, y
+
+# Inverse of project, turns plane coordinates in km back into lat and lon
+def unproject(x, y, ref_lat, ref_lon):
+    lat = ref_lat + np.degrees(np.asarray(y, dtype=float) / EARTH_RADIUS)
+    lon = ref_lon + np.degrees(np.asarray(x, dtype=float) / (EARTH_RADIUS * np.cos(np.radians(ref_lat))))
+    return lat, lon
+
+# Build a uniform grid index over a list of (lat, lon) points
+# Points are sorted by cell so the points of a cell are one contiguous slice
+def build_index(points, cell_km=CELL_KM, ref=None):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if ref is None:
+        ref = (float(points[:, 0].mean()), float(points[:, 1].mean())) if len(points) else (0.0, 0.0)
+    x, y = project(points[:, 0], points[:, 1], ref[0], ref[1])
+
+    cx = np.floor(x / cell_km).astype(np.int64)
+    cy = np.floor(y / cell_km).astype(np.int64)
+    order = np.lexsort((cy, cx))
+    cx, cy = cx[order], cy[order]
+
+    # Start and end of each occupied cell inside the sorted arrays
+    cells = {}
+    if len(order):
+        change = np.flatnonzero((np.diff(cx) != 0) | (np.diff(cy) != 0)) + 1
+        starts = np.concatenate(([0], change))
+        ends = np.concatenate((change, [len(order)]))
+        for start, end in zip(starts, ends):
+            cells[(int(cx[start]), int(cy[start]))] = (int(start), int(end))
+
+    return {
+        'ref': ref,
+        'cell_km': cell_km,
+        'x': x[order],
+        'y': y[order],
+        'order': order,
+        'cells': cells,
+        'bounds': (int(cx.min()), int(cx.max()), int(cy.min()), int(cy.max())) if len(order) else (0, -1, 0, -1),
+    }
+
+# Positions (in sorted order) of the points in every cell of the square ring at distance ring
+def _ring_slots(index, cx, cy, ring):
+    cells = index['cells']
+    if ring == 0:
+        keys = [(cx, cy)]
+    else:
+        keys = [(cx + dx, cy + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+        keys += [(cx + dx, cy + dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+    slots = [np.arange(*cells[key]) for key in keys if key in cells]
+    return np.concatenate(slots) if slots else np.empty(0, dtype=np.int64)
+
+# Largest ring that can still hold points, searching past it finds nothing new
+def _max_ring(index, cx, cy):
+    min_x, max_x, min_y, max_y = index['bounds']
+    return max(cx - min_x, max_x - cx, cy - min_y, max_y - cy, 0)
+
+# Yield (position, distance in km) of the indexed points in order of increasing distance
+# Rings of cells are only searched when the next nearest point could be in them,
+# so taking the first k results only touches the cells around the query
+def iter_nearest(index, lat, lon):
+    if not len(index['order']):
+        return
+    cell_km = index['cell_km']
+    qx, qy = project(lat, lon, *index['ref'])
+    qx, qy = float(qx), float(qy)
+    cx, cy = int(np.floor(qx / cell_km)), int(np.floor(qy / cell_km))
+
+    # Distance from the query to the edge of its cell, every point outside ring r
+    # is at least this far plus r - 1 cells away
+    edge = min(qx - cx * cell_km, (cx + 1) * cell_km - qx, qy - cy * cell_km, (cy + 1) * cell_km - qy)
+    last_ring = _max_ring(index, cx, cy)
+
+    heap = []
+    ring = 0
+    while True:
+        if ring <= last_ring:
+            slots = _ring_slots(index, cx, cy, ring)
+            if len(slots):
+                dist = np.hypot(index['x'][slots] - qx, index['y'][slots] - qy)
+                for slot, d in zip(slots.tolist(), dist.tolist()):
+                    heapq.heappush(heap, (d, slot))
+            safe = edge + ring * cell_km
+        else:
+            safe = np.inf
+
+        while heap and heap[0][0] <= safe:
+            d, slot = heapq.heappop(heap)
+            yield int(index['order'][slot]), d
+
+        if ring > last_ring and not heap:
+            return
+        ring += 1
+
+# Position and distance in km of the point nearest to (lat, lon)
+def nearest(index, lat, lon):
+    for position, dist in iter_nearest(index, lat, lon):
+        return position, dist
+    return None, np.inf
+
+# Nearest point for many queries at once
+# Queries are grouped by cell and checked against the 3x3 block of cells around them
+# in one vectorized step. A match closer than one cell is exact because anything outside
+# the block is further away than that, the rest fall back to the ring search.
+def nearest_batch(index, lats, lons):
+    lats = np.asarray(lats, dtype=float).ravel()
+    lons = np.asarray(lons, dtype=float).ravel()
+    positions = np.full(len(lats), -1, dtype=np.int64)
+    dists = np.full(len(lats), np.inf)
+    if not len(index['order']) or not len(lats):
+        return positions, dists
+
+    cell_km = index['cell_km']
+    qx, qy = project(lats, lons, *index['ref'])
+    cx = np.floor(qx / cell_km).astype(np.int64)
+    cy = np.floor(qy / cell_km).astype(np.int64)
+
+    keys, inverse = np.unique(np.stack((cx, cy), axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    group_order = np.argsort(inverse, kind='stable')
+    group_bounds = np.searchsorted(inverse[group_order], np.arange(len(keys) + 1))
+
+    for g, (gx, gy) in enumerate(keys.tolist()):
+        queries = group_order[group_bounds[g]:group_bounds[g + 1]]
+        slots = [_ring_slots(index, gx, gy, 0), _ring_slots(index, gx, gy, 1)]
+        slots = np.concatenate(slots)
+        if not len(slots):
+            continue
+        dist = np.hypot(index['x'][slots][None, :] - qx[queries, None], index['y'][slots][None, :] - qy[queries, None])
+        best = dist.argmin(axis=1)
+        positions[queries] = index['order'][slots[best]]
+        dists[queries] = dist[np.arange(len(queries)), best]
+
+    # Matches that are not guaranteed to be the nearest get the exact ring search
+    for q in np.flatnonzero(dists > cell_km).tolist():
+        positions[q], dists[q] = nearest(index, lats[q], lons[q])
+
+    return positions, dists
+
+# Positions of all points within rad km of (lat, lon)
+def within(index, lat, lon, rad):
+    found = []
+    for position, dist in iter_nearest(index, lat, lon):
+        if dist > rad:
+            break
+        found.append(position)
+    return np.array(found, dtype=np.int64)
+
+# Points within rad km of many queries at once
+# Queries are grouped by cell and each group is checked against the square of cells that
+# can hold points within rad in one vectorized step. The result is in compressed form:
+# the positions near query q are positions[offsets[q]:offsets[q + 1]].
+def within_batch(index, lats, lons, rad):
+    lats = np.asarray(lats, dtype=float).ravel()
+    lons = np.asarray(lons, dtype=float).ravel()
+    found = [np.empty(0, dtype=np.int64)] * len(lats)
+    if len(index['order']) and len(lats):
+        cell_km = index['cell_km']
+        rings = int(np.ceil(rad / cell_km))
+        qx, qy = project(lats, lons, *index['ref'])
+        cx = np.floor(qx / cell_km).astype(np.int64)
+        cy = np.floor(qy / cell_km).astype(np.int64)
+
+        keys, inverse = np.unique(np.stack((cx, cy), axis=1), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        group_order = np.argsort(inverse, kind='stable')
+        group_bounds = np.searchsorted(inverse[group_order], np.arange(len(keys) + 1))
+
+        for g, (gx, gy) in enumerate(keys.tolist()):
+            slots = np.concatenate([_ring_slots(index, gx, gy, ring) for ring in range(rings + 1)])
+            if not len(slots):
+                continue
+            queries = group_order[group_bounds[g]:group_bounds[g + 1]]
+            dist = np.hypot(index['x'][slots][None, :] - qx[queries, None], index['y'][slots][None, :] - qy[queries, None])
+            for q, near in zip(queries.tolist(), dist <= rad):
+                found[q] = index['order'][slots[near]]
+
+    offsets = np.zeros(len(lats) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(f) for f in found])
+    positions = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+    return offsets, positions
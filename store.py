@@ -0,0 +1,130 @@
+import sqlite3
+import time
+import numpy as np
+import spatial
+import adversary
+
+# File that holds the results of every compare.py run
+STORE_FILE = "results.db"
+
+# Version of the candidate data and methods, bump it when they change so old results
+# are recomputed instead of read back
+# Version 2 drops duplicate candidates (dedup.py)
+# Version 3 merges the tags of duplicates before policies and opening hours are applied
+DATA_VERSION = "3"
+
+# Columns that identify a result, a run with the same values gives the same result
+KEY_COLUMNS = ("address", "radius", "method", "noise", "num_runs", "seed", "data_version")
+
+# Open the store and create the results table the first time
+# Rows are only ever appended, the newest row for a key is the current result
+def open_store(filename=STORE_FILE):
+    conn = sqlite3.connect(filename)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            address TEXT NOT NULL,
+            radius REAL NOT NULL,
+            method TEXT NOT NULL,
+            noise REAL,
+            num_runs TEXT NOT NULL,
+            seed INTEGER,
+            data_version TEXT NOT NULL,
+            lat REAL,
+            lon REAL,
+            utility REAL,
+            privacy REAL,
+            adversary REAL,
+            created REAL NOT NULL
+        )
+    """)
+    # Stores made before adaptive runs existed do not have the runs_used column yet
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+    if 'runs_used' not in columns:
+        conn.execute("ALTER TABLE results ADD COLUMN runs_used INTEGER")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS results_key ON results ({', '.join(KEY_COLUMNS)})")
+    # Results that are out of date because the map data around them changed
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS invalidations (
+            result_id INTEGER PRIMARY KEY,
+            created REAL NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+# Build the key of a result, num_runs is kept as text so 'auto' style values also work
+def make_key(address, radius, method, noise=None, num_runs=None, seed=None, data_version=DATA_VERSION):
+    return (address, float(radius), method, noise, str(num_runs), seed, data_version)
+
+# Newest stored result for a key, or None when it has to be computed
+# IS is used instead of = so that keys with no noise or no seed still match
+# A result that was invalidated also has to be computed again
+def lookup(conn, key):
+    where = " AND ".join(f"{column} IS ?" for column in KEY_COLUMNS)
+    row = conn.execute(
+        f"SELECT utility, privacy, adversary, runs_used, id IN (SELECT result_id FROM invalidations) "
+        f"FROM results WHERE {where} ORDER BY id DESC LIMIT 1",
+        key
+    ).fetchone()
+    if row is None or row[4]:
+        return None
+    return row[:4]
+
+# Append a result for a key, runs_used is only known for adaptive runs
+def append(conn, key, coords, utility, privacy, adversary=None, runs_used=None):
+    conn.execute(
+        f"INSERT INTO results ({', '.join(KEY_COLUMNS)}, lat, lon, utility, privacy, adversary, runs_used, created) "
+        f"VALUES ({', '.join('?' * len(KEY_COLUMNS))}, ?, ?, ?, ?, ?, ?, ?)",
+        (*key, coords[0], coords[1], utility, privacy, adversary, runs_used, time.time())
+    )
+    conn.commit()
+
+# Invalidate every result whose circle overlaps one of the boxes
+# The circle reaches adversary.area_radius of the result's radius, since the adversary
+# error also depends on the candidates past the radius.
+# boxes are (south, west, north, east) in degrees, like the tiles osm_change.py updates.
+# Results are never changed, their ids are appended to the invalidations table.
+# Returns the number of results invalidated.
+def invalidate(conn, boxes):
+    rows = conn.execute(
+        "SELECT id, lat, lon, radius FROM results "
+        "WHERE lat IS NOT NULL AND id NOT IN (SELECT result_id FROM invalidations)"
+    ).fetchall()
+    if not rows or not boxes:
+        return 0
+    ids, lat, lon, radius = (np.array(column) for column in zip(*rows))
+    boxes = np.asarray(boxes, dtype=float)
+
+    # Distance in km from each circle center to the closest point of each box
+    near_lat = np.clip(lat[:, None], boxes[:, 0], boxes[:, 2])
+    near_lon = np.clip(lon[:, None], boxes[:, 1], boxes[:, 3])
+    x, y = spatial.project(near_lat, near_lon, lat[:, None], lon[:, None])
+    hit = (np.hypot(x, y) <= adversary.area_radius(radius)[:, None]).any(axis=1)
+
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO invalidations (result_id, created) VALUES (?, ?)",
+        [(int(result_id), now) for result_id in ids[hit]]
+    )
+    conn.commit()
+    return int(hit.sum())
+
+# Average utility, privacy and adversary error per method over a set of keys
+# The keys go into a temporary table so the averages are a single grouped query
+def method_averages(conn, keys):
+    conn.execute("DROP TABLE IF EXISTS temp.batch")
+    conn.execute(f"CREATE TEMP TABLE batch ({', '.join(KEY_COLUMNS)})")
+    conn.executemany(f"INSERT INTO temp.batch VALUES ({', '.join('?' * len(KEY_COLUMNS))})", keys)
+    join = " AND ".join(f"r.{column} IS b.{column}" for column in KEY_COLUMNS)
+    rows = conn.execute(f"""
+        SELECT r.method, AVG(r.utility), AVG(r.privacy), AVG(r.adversary)
+        FROM (SELECT DISTINCT * FROM temp.batch) b
+        JOIN results r ON {join}
+        WHERE r.id = (
+            SELECT MAX(id) FROM results WHERE {join.replace('r.', '')}
+        )
+        GROUP BY r.method
+        ORDER BY MIN(r.id)
+    """).fetchall()
+    return rows
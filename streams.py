@@ -0,0 +1,40 @@
+import zlib
+import numpy as np
+
+# Runs in one shard of a job, shards are the unit handed to processes or machines
+SHARD_RUNS = 100000
+
+# Seed for a run that was not given one, print it so the run can be repeated
+def new_seed():
+    return int(np.random.SeedSequence().generate_state(1, np.uint64)[0] >> np.uint64(1))
+
+# Read a seed typed by the user, blank means a new random seed
+# Raises ValueError for anything but a non-negative integer, which is what SeedSequence takes
+def parse_seed(value):
+    value = str(value).strip()
+    if not value:
+        return new_seed()
+    seed = int(value)
+    if seed < 0:
+        raise ValueError(f"Invalid seed {value}, it must not be negative")
+    return seed
+
+# Stable 32 bit key of a label, unlike hash() it is the same in every process
+def label_key(label):
+    return zlib.crc32(str(label).encode('utf-8'))
+
+# Random generator of one (location, method, shard)
+# The labels go into the spawn key of the seed sequence, so every stream can be made on
+# its own in any process and no two of them overlap. Philox is a counter based generator,
+# which is what makes many independent streams from one seed safe.
+def stream(seed, location, method, shard=0):
+    sequence = np.random.SeedSequence(seed, spawn_key=(label_key(location), label_key(method), shard))
+    return np.random.Generator(np.random.Philox(sequence))
+
+# Number of shards of a job of num_runs runs
+def num_shards(num_runs):
+    return -(-num_runs // SHARD_RUNS)
+
+# Runs covered by a shard as (start, end)
+def shard_runs(shard, num_runs):
+    return shard * SHARD_RUNS, min((shard + 1) * SHARD_RUNS, num_runs)
@@ -0,0 +1,96 @@
+import numpy as np
+
+# Tags that get a bit in a candidate's mask, 'key=*' matches any value of the key
+# Adding a tag here is enough to use it in a policy, masks are compiled from the raw
+# tags when a tile is loaded so the cache does not have to be fetched again.
+# There are 64 bits available.
+TAG_BITS = [
+    'amenity=*',
+    'tourism=*',
+    'leisure=*',
+    'shop=*',
+    'highway=*',
+    'name=*',
+    'access=private',
+    'access=no',
+    'access=customers',
+    'amenity=parking',
+    'amenity=parking_space',
+    'amenity=parking_entrance',
+    'amenity=bicycle_parking',
+    'amenity=fuel',
+    'highway=motorway',
+    'highway=motorway_link',
+    'highway=trunk',
+    'highway=trunk_link',
+    'highway=primary',
+    'highway=secondary',
+    'highway=tertiary',
+    'highway=residential',
+    'highway=living_street',
+    'highway=service',
+    'highway=track',
+    'highway=footway',
+    'highway=pedestrian',
+    'highway=path',
+    'highway=cycleway',
+    'highway=steps',
+    'highway=construction',
+    'highway=proposed',
+    'service=driveway',
+    'service=parking_aisle',
+    'service=alley',
+    'foot=no',
+    'foot=yes',
+    'sidewalk=no',
+    'opening_hours=*',
+]
+
+BIT_OF = {tag: bit for bit, tag in enumerate(TAG_BITS)}
+
+# Tags every policy denies for a kind of candidate
+DEFAULT_DENY = {
+    'poi': [],
+    'walkable': ['highway=motorway', 'highway=motorway_link'],
+}
+
+# Bitmask of one element's tags
+def compile_tags(tags):
+    mask = 0
+    for key, value in tags.items():
+        bit = BIT_OF.get(f"{key}={value}")
+        if bit is not None:
+            mask |= 1 << bit
+        bit = BIT_OF.get(f"{key}=*")
+        if bit is not None:
+            mask |= 1 << bit
+    return mask
+
+# Bitmasks of a list of elements as a numpy array
+def compile_elements(elements):
+    return np.array([compile_tags(el.get('tags', {})) for el in elements], dtype=np.uint64)
+
+# Bitmask with the bits of a list of tags like ['access=private', 'highway=service']
+def mask_of(tag_list):
+    mask = 0
+    for tag in tag_list:
+        if tag not in BIT_OF:
+            raise ValueError(f"Unknown tag {tag}, add it to tags.TAG_BITS")
+        mask |= 1 << BIT_OF[tag]
+    return np.uint64(mask)
+
+# Build a policy for a kind of candidate
+# A candidate passes when it has none of the denied tags and, if allow is not empty,
+# at least one of the allowed tags. The default denies of the kind are always included.
+def make_policy(kind, allow=(), deny=()):
+    return {
+        'allow': mask_of(allow),
+        'deny': mask_of(list(DEFAULT_DENY.get(kind, [])) + list(deny)),
+    }
+
+# Boolean array of the candidates that pass a policy
+def select(masks, policy):
+    keep = (masks & policy['deny']) == 0
+    if policy['allow']:
+        keep &= (masks & policy['allow']) != 0
+    return keep
@@ -0,0 +1,32 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import osm_cache
+import snapshot
+
+FIXTURES = os.path.join(ROOT, "tests", "fixtures")
+
+# Box of the extract fixture, the tiles completely inside it are cached
+EXTRACT_BOX = (47.9999, 10.9999, 48.0401, 11.0401)
+
+def fixture_path(name):
+    return os.path.join(FIXTURES, name)
+
+# Cache filled from the extract fixture in an empty folder
+# Any request to Overpass fails the test, everything has to come from the fixtures
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(osm_cache, "_tiles", {})
+    monkeypatch.setattr(snapshot, "_loaded", {})
+
+    def no_requests(query, timeout=180):
+        raise AssertionError("tests must not send Overpass queries")
+
+    monkeypatch.setattr(osm_cache, "overpass", no_requests)
+    osm_cache.load_extract(fixture_path("extract.json"), *EXTRACT_BOX)
+    return tmp_path
@@ -0,0 +1,49 @@
+import opening_hours
+import osm_cache
+import osm_change
+import tags
+from conftest import fixture_path
+
+SATURDAY_MORNING = opening_hours.parse_slot("Sa 10:00")
+
+def street_ids():
+    return sorted(el['id'] for el in osm_cache.fetch_elements('walkable', 48.01, 11.01, 0.5))
+
+def cafes(policy=None, open_at=None):
+    return [el for el in osm_cache.fetch_elements('poi', 48.03, 11.03, 0.1, policy, open_at)
+            if el['tags'].get('name') == "Corner Cafe"]
+
+def apply(name):
+    osm_change.apply_changes(*osm_change.parse(fixture_path(name)))
+
+def private_denied():
+    return tags.make_policy('poi', deny=['access=private'])
+
+def test_duplicates_merge_into_one_with_all_tags(cache):
+    assert street_ids() == [10]
+    [cafe] = cafes()
+    assert cafe['type'] == 'node'
+    assert cafe['tags']['opening_hours'] == "Mo-Fr 08:00-18:00"
+    assert cafes(private_denied()) == []
+    assert cafes(open_at=SATURDAY_MORNING) == []
+
+def test_delete_kept_member(cache):
+    apply("delete_kept.osc")
+    assert street_ids() == [11]
+
+def test_delete_merged_member(cache):
+    apply("delete_merged.osc")
+    [cafe] = cafes(private_denied())
+    assert cafe['id'] == 1
+    assert 'access' not in cafe['tags']
+    assert 'opening_hours' not in cafe['tags']
+
+def test_modify_kept_member(cache):
+    apply("modify_kept.osc")
+    assert street_ids() == [10, 11]
+
+def test_modify_merged_member(cache):
+    apply("modify_merged.osc")
+    [cafe] = cafes(private_denied(), SATURDAY_MORNING)
+    assert cafe['id'] == 1
+    assert cafe['tags']['opening_hours'] == "Sa 09:00-12:00"
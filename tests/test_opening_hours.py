@@ -0,0 +1,14 @@
+import pytest
+import opening_hours
+
+@pytest.mark.parametrize("value", ['Mo-Fr 12:75-13:00', 'Mo 25:00-26:00', 'Mo 22:00-24:30'])
+def test_parse_rejects_times_out_of_range(value):
+    assert opening_hours.parse(value) is None
+
+def test_parse_accepts_end_of_day():
+    assert opening_hours.parse('Mo 00:00-24:00') is not None
+
+@pytest.mark.parametrize("value", ['Su 25:00', 'Mo 12:75', 'Mo 24:00'])
+def test_parse_slot_rejects_times_out_of_range(value):
+    with pytest.raises(ValueError):
+        opening_hours.parse_slot(value)
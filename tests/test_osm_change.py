@@ -0,0 +1,57 @@
+import osm_cache
+import osm_change
+import store
+from conftest import fixture_path
+
+CHANGED_TILES = {('poi', (2401, 551)), ('poi', (2400, 551))}
+
+def names_near(lat, lon, rad):
+    return {el['tags'].get('name') for el in osm_cache.fetch_elements('poi', lat, lon, rad)}
+
+def test_parse():
+    changes, positions = osm_change.parse(fixture_path("change.osc"))
+    assert {key: action for key, (action, _) in changes.items()} == {
+        ('node', 5): 'create',
+        ('node', 3): 'modify',
+        ('node', 4): 'modify',
+        ('node', 6): 'delete',
+    }
+    assert changes[('node', 3)][1]['tags']['name'] == "Corner Bakery"
+    assert positions[4] == (48.005, 11.035)
+
+def test_apply_changes(cache):
+    assert {"Bakery", "Old Bench", "Kiosk"} <= names_near(48.03, 11.03, 0.5)
+
+    changed = osm_change.apply_changes(*osm_change.parse(fixture_path("change.osc")))
+    assert changed == CHANGED_TILES
+
+    names = names_near(48.03, 11.03, 0.5)
+    assert {"New Restaurant", "Corner Bakery"} <= names
+    assert not names & {"Bakery", "Old Bench", "Kiosk"}
+    # The moved bench is in its new tile
+    assert names_near(48.005, 11.035, 0.1) == {"Old Bench"}
+
+def test_apply_file_invalidates_results_around_changes(cache):
+    store_file = str(cache / "results.db")
+    conn = store.open_store(store_file)
+    keys = {
+        # Circle over a changed tile
+        'inside': store.make_key("inside", 0.5, "POI"),
+        # Only the area the adversary reads, twice the radius, reaches a changed tile
+        'ring': store.make_key("ring", 0.3, "POI"),
+        'far': store.make_key("far", 0.3, "POI"),
+    }
+    store.append(conn, keys['inside'], (48.03, 11.03), 1.0, 1.0, 1.0)
+    store.append(conn, keys['ring'], (48.03, 11.045), 1.0, 1.0, 1.0)
+    store.append(conn, keys['far'], (48.03, 11.07), 1.0, 1.0, 1.0)
+    conn.close()
+
+    changed, invalidated = osm_change.apply_file(fixture_path("change.osc"), store_file)
+    assert changed == CHANGED_TILES
+    assert invalidated == 2
+
+    conn = store.open_store(store_file)
+    assert store.lookup(conn, keys['inside']) is None
+    assert store.lookup(conn, keys['ring']) is None
+    assert store.lookup(conn, keys['far']) is not None
+    conn.close()
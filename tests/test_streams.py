@@ -0,0 +1,11 @@
+import pytest
+import streams
+
+def test_parse_seed():
+    assert streams.parse_seed(" 42 ") == 42
+    assert streams.parse_seed("") >= 0
+
+@pytest.mark.parametrize("value", ["-3", "seed"])
+def test_parse_seed_rejects_invalid_seeds(value):
+    with pytest.raises(ValueError):
+        streams.parse_seed(value)
@@ -3,14 +3,12 @@ from geopy.geocoders import Nominatim
 from folium import Circle
 import webbrowser
 import os
-import requests
 from tqdm import tqdm
 import numpy as np
-import matplotlib.pyplot as plt
 from collections import defaultdict
-
-# Using the Overpass API for mapping
-OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+import adversary
+import osm_cache
+import render
 
 # Generate coordinates from an address
 def get_coordinates(address):
@@ -22,21 +20,11 @@ def get_coordinates(address):
         return None
 
 # Using coordinates, find walkable areas using a query
-def FindWalkableAreas(lat, lon, rad):
-
-    # Query for areas around highways
-    query = f"""
-    [out:json];
-    (
-      way["highway"](around:{rad * 1000},{lat},{lon})
-        ["highway"!~"motorway|motorway_link"];
-    );
-    out center tags;
-    """
+def FindWalkableAreas(lat, lon, rad, policy=None, spacing=None):
+
+    # Query for areas around highways, served from the tile cache when it covers the radius
     try:
-        response = requests.get(OVERPASS_URL, params={'data': query}, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = {'elements': osm_cache.fetch_elements('walkable', lat, lon, rad, policy, spacing=spacing)}
     except Exception as e:
         print("Overpass API error:", e)
         return []
@@ -83,11 +71,13 @@ def create_map(center_lat, center_lon, radius_km, walkable_areas):
     webbrowser.open('file://' + os.path.realpath("Walkable_Map.html"))
 
 # Write to a text file all the found walkable locations
-def save_to_file(points, filename="Walkable.txt"):
+def save_to_file(points, filename="Walkable.txt", adversary_error=None):
     with open(filename, "w", encoding="utf-8") as f:
         f.write("Walkable areas:\n\n")
         for name, lat, lon, tags, status in points:
             f.write(f"{name}: ({lat}, {lon})\n")
+        if adversary_error is not None:
+            f.write(f"Adversary error: {adversary_error}\n")
 
 # Harversine formula for finding the distance between two coordinates
 # https://www.geeksforgeeks.org/haversine-formula-to-find-distance-between-two-points-on-a-sphere/
@@ -137,7 +127,9 @@ def main():
     
     # From the user get the number of runs
     try:
-        num_runs = int(input("Enter number of points to keep: "))
+        # The walkable method is not random so 'auto' just keeps every walkable area
+        runs_input = input("Enter number of points to keep (or 'auto'): ").strip().lower()
+        num_runs = None if runs_input == 'auto' else int(runs_input)
     except ValueError:
         print("Invalid number of points")
         return
@@ -152,62 +144,72 @@ def main():
     walkable_areas = []
     utility_values = []
     privacy_values = []
+    adversary_values = []
 
-    if len(total_walkable_areas) < num_runs:
+    if num_runs is None or len(total_walkable_areas) < num_runs:
         num_runs = len(total_walkable_areas)
 
+    # Precompute the Bayesian adversary over a grid around the user
+    # It also needs the walkable areas the cells away from the user can reach, which go past the radius
+    walkable_coords = [(p[1], p[2]) for p in total_walkable_areas]
+    area_coords = [(p[1], p[2]) for p in FindWalkableAreas(coords[0], coords[1], adversary.area_radius(radius))]
+    adversary_model = adversary.build_model(coords[0], coords[1], radius, walkable_coords, area=area_coords)
+    adversary_counts = np.zeros(len(total_walkable_areas))
+
+    # Running sums of the chosen coordinates and walking distances
+    lat_sum = 0.0
+    lon_sum = 0.0
+    total = 0.0
+
     # For each iteration, calculate the privacy and utility values and save them
     for x in range(num_runs):
         chosen = total_walkable_areas[x]
         walkable_areas.append(chosen)
+        adversary_counts[x] += 1
 
         utility = 0.0
         privacy = 0.0
 
         # Privacy is the distance from the centroid of all current POIs in the iteration to the chosen location
-        lat_sum = sum(p[1] for p in walkable_areas)
-        lon_sum = sum(p[2] for p in walkable_areas)
+        # The sums are kept between iterations instead of going over every chosen area again
+        lat_sum += chosen[1]
+        lon_sum += chosen[2]
         centroid_lat = lat_sum / len(walkable_areas)
         centroid_lon = lon_sum / len(walkable_areas)
         privacy = CalculateDistance(coords[0], coords[1], centroid_lat, centroid_lon)
 
-        total = 0
-        for _, lat, lon, *_ in walkable_areas:
-            total += CalculateDistance(coords[0], coords[1], lat, lon)
-        utility = total / x
+        total += CalculateDistance(coords[0], coords[1], chosen[1], chosen[2])
+        utility = total / len(walkable_areas)
+
+        # Adversary error is the expected distance between the adversary's guess and the user
+        adversary_error = adversary.expected_error(adversary_model, adversary_counts)
 
         utility_values.append(utility)
         privacy_values.append(privacy)
+        adversary_values.append(adversary_error)
 
         print(f"Iteration {x + 1}")
         print(f"Privacy = {privacy}")
         print(f"Utility = {utility}")
+        print(f"Adversary Error = {adversary_error}")
         print("")
 
-    # Create the map and text files
-    save_to_file(walkable_areas)
-    create_map(coords[0], coords[1], radius, walkable_areas)
+    # With no points kept the adversary only has the prior to guess from
+    final_adversary_error = adversary_values[-1] if adversary_values else adversary.expected_error(adversary_model, adversary_counts)
 
-    # Plot the privacy and utility vs iteration
-    plt.figure(figsize=(12, 5))
+    # Create the map, text files and graph in the background so the results above are not held up
+    render.submit(save_to_file, walkable_areas, adversary_error=final_adversary_error,
+                  callback=render.announce("Walkable.txt"))
+    render.submit(create_map, coords[0], coords[1], radius, walkable_areas,
+                  callback=render.announce("Walkable_Map.html"))
 
-    plt.subplot(1, 2, 1)
-    plt.plot(range(1, num_runs + 1), utility_values, marker='o', color='green')
-    plt.title('Utility vs Iteration')
-    plt.xlabel('Iteration')
-    plt.ylabel('Utility (Avg Distance to Chosen POIs)')
-
-    plt.subplot(1, 2, 2)
-    plt.plot(range(1, num_runs + 1), privacy_values, marker='o', color='red')
-    plt.title('Privacy vs Iteration')
-    plt.xlabel('Iteration')
-    plt.ylabel('Privacy (Distance to Centroid of POIs)')
-
-    plt.tight_layout()
-    plt.savefig("Walkable_Utility_Privacy_Graph")
-    plt.show()
-
-    
+    # Plot the privacy and utility vs iteration
+    render.submit(render.plot_runs, "Walkable_Utility_Privacy_Graph", range(1, num_runs + 1), [
+        (utility_values, 'green', 'Utility vs Iteration', 'Utility (Avg Distance to Chosen POIs)'),
+        (privacy_values, 'red', 'Privacy vs Iteration', 'Privacy (Distance to Centroid of POIs)'),
+        (adversary_values, 'purple', 'Adversary Error vs Iteration', 'Adversary Error (Expected Guess Distance)'),
+    ], show=True, callback=render.announce("Walkable_Utility_Privacy_Graph.png"))
 
 if __name__ == "__main__":
     main()
+    render.wait()